@@ -0,0 +1,240 @@
+"""
+Micro-benchmarks for the mygpt components, generation and training step.
+
+Every case reports mean and p50/p90/p99 latency, tokens/sec and the peak RSS of the process so
+far, swept over batch size, sequence length and intra-op thread count. Results are written as
+JSON and can be compared with a saved baseline; cases whose tokens/sec dropped by more than
+--tolerance are reported as regressions and make the script exit with status 1.
+
+Usage example:
+python bench_mygpt.py --config tiny --out bench_results.json
+python bench_mygpt.py --config 124M --batch-sizes 1 4 --seq-lens 128 512 --threads 1 8 --baseline bench_results.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import torch
+
+from mygpt import (GPT_CONFIG_124M, GELU, FeedForward, GPTModel, LayerNorm, MultiHeadAttention,
+    TransformerBlock, generate_text_cached, generate_text_simple)
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+CONFIGS = {
+    "124M": GPT_CONFIG_124M,
+    "tiny": {**GPT_CONFIG_124M, "context_length": 256, "emb_dim": 128, "n_heads": 4, "n_layers": 2},
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 2**10, 1)
+
+
+def time_it(fn, warmup, repeats):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def summarise(name, params, times, tokens):
+    # tokens: number of tokens processed (or generated) by one timed call; tokens/sec is None when
+    # the mean is 0, e.g. decode steps lost in the noise of the prefill that was subtracted
+    mean = statistics.mean(times)
+    return {
+        "name": name,
+        "params": params,
+        "mean_ms": round(mean * 1e3, 3),
+        "p50_ms": round(percentile(times, 50) * 1e3, 3),
+        "p90_ms": round(percentile(times, 90) * 1e3, 3),
+        "p99_ms": round(percentile(times, 99) * 1e3, 3),
+        "tokens_per_sec": round(tokens / mean, 1) if mean > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_components(cfg, batch_size, seq_len, warmup, repeats):
+    emb_dim = cfg["emb_dim"]
+    x = torch.randn(batch_size, seq_len, emb_dim)
+    components = {
+        "MultiHeadAttention": MultiHeadAttention(emb_dim, emb_dim, cfg["context_length"], 0.0, cfg["n_heads"],
+            cfg["qkv_bias"], cfg.get("attn_backend", "sdpa")),
+        "LayerNorm": LayerNorm(emb_dim),
+        "GELU": GELU(),
+        "FeedForward": FeedForward(cfg),
+        "TransformerBlock": TransformerBlock(cfg),
+    }
+    results = []
+    with torch.no_grad():
+        for name, module in components.items():
+            module.eval()
+            times = time_it(lambda: module(x), warmup, repeats)
+            results.append(summarise(name, {}, times, batch_size * seq_len))
+    return results
+
+
+def bench_model(model, cfg, batch_size, seq_len, new_tokens, warmup, repeats):
+    idx = torch.randint(0, cfg["vocab_size"], (batch_size, seq_len))
+    context_size = cfg["context_length"]
+    results = []
+
+    def prefill_cached():
+        model.reset_kv_cache()
+        model(idx[:, -context_size:], use_cache=True)
+
+    with torch.no_grad():
+        times = time_it(lambda: model(idx), warmup, repeats)
+        # the cached path prefills into the kv cache, which costs a little more than a plain forward
+        prefill = {"generate_text_simple": statistics.mean(times),
+                   "generate_text_cached": statistics.mean(time_it(prefill_cached, warmup, repeats))}
+        model.reset_kv_cache()
+    results.append(summarise("GPTModel.prefill", {}, times, batch_size * seq_len))
+
+    # a generate call is one prefill (which yields the first token) plus new_tokens - 1 decode
+    # steps; the mean prefill time of the same path is subtracted, so the decode figures are per
+    # decode step only
+    steps = new_tokens - 1
+    for name, generate in (("generate_text_simple", generate_text_simple), ("generate_text_cached", generate_text_cached)):
+        if steps < 1:
+            break  # --new-tokens 1 is all prefill
+        totals = time_it(lambda: generate(model, idx, new_tokens, context_size), min(warmup, 1), repeats)
+        times = [max(0.0, total - prefill[name]) for total in totals]
+        result = summarise(f"{name}.decode", {"new_tokens": new_tokens}, times, batch_size * steps)
+        result["ms_per_token"] = round(result["mean_ms"] / steps, 3)
+        result["prefill_ms"] = round(prefill[name] * 1e3, 3)
+        results.append(result)
+    return results
+
+
+def bench_train_step(model, cfg, batch_size, seq_len, warmup, repeats):
+    idx = torch.randint(0, cfg["vocab_size"], (batch_size, seq_len + 1))
+    inputs, targets = idx[:, :-1], idx[:, 1:]
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        logits = model(inputs)
+        loss = torch.nn.functional.cross_entropy(logits.flatten(0, 1), targets.flatten())
+        loss.backward()
+        optimizer.step()
+
+    model.train()
+    times = time_it(step, min(warmup, 1), repeats)
+    model.eval()
+    return [summarise("GPTModel.train_step", {}, times, batch_size * seq_len)]
+
+
+def run(args):
+    cfg = {**CONFIGS[args.config], "drop_rate": 0.0, "attn_backend": args.attn_backend}
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+
+    results = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            for seq_len in args.seq_lens:
+                if seq_len + args.new_tokens > cfg["context_length"]:
+                    print(f"skipping seq_len {seq_len}: exceeds context_length {cfg['context_length']}")
+                    continue
+                sweep = {"threads": threads, "batch_size": batch_size, "seq_len": seq_len}
+                cases = bench_components(cfg, batch_size, seq_len, args.warmup, args.repeats)
+                cases += bench_model(model, cfg, batch_size, seq_len, args.new_tokens, args.warmup, args.repeats)
+                if not args.skip_train:
+                    cases += bench_train_step(model, cfg, batch_size, seq_len, args.warmup, args.repeats)
+                for case in cases:
+                    case["params"] = {**sweep, **case["params"]}
+                    print(f"{case['name']:<30} {json.dumps(case['params']):<75} "
+                          f"{case['mean_ms']:>10.2f} ms  p99 {case['p99_ms']:>10.2f} ms  "
+                          f"{case['tokens_per_sec'] or float('nan'):>12.1f} tok/s  rss {case['peak_rss_mb']} MB")
+                results += cases
+
+    return {
+        "meta": {
+            "config": args.config,
+            "attn_backend": args.attn_backend,
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y%m%d-%H%M%S"),
+        },
+        "results": results,
+    }
+
+
+def case_key(case):
+    return case["name"], json.dumps(case["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance):
+    # returns the cases whose tokens/sec fell by more than tolerance (a fraction) against the baseline
+    previous = {case_key(case): case for case in baseline["results"]}
+    regressions = []
+    for case in results["results"]:
+        old = previous.get(case_key(case))
+        if old is None or not case["tokens_per_sec"] or not old["tokens_per_sec"]:
+            continue
+        change = case["tokens_per_sec"] / old["tokens_per_sec"] - 1
+        marker = "REGRESSION" if change < -tolerance else ""
+        print(f"{case['name']:<30} {json.dumps(case['params']):<75} {change:+8.1%} {marker}")
+        if marker:
+            regressions.append({"name": case["name"], "params": case["params"], "change": round(change, 4)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mygpt components, generation and training")
+    # optional flags
+    parser.add_argument("--config", choices=CONFIGS, default="tiny", help="Model size to benchmark")
+    parser.add_argument("--attn-backend", choices=["sdpa", "eager"], default="sdpa", help="Attention kernel")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4], help="Batch sizes to sweep")
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=[64, 128], help="Prompt/sequence lengths to sweep")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()], help="Intra-op thread counts to sweep")
+    parser.add_argument("--new-tokens", type=int, default=16, help="Tokens generated per decode call")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed calls before each case")
+    parser.add_argument("--repeats", type=int, default=10, help="Timed calls per case")
+    parser.add_argument("--skip-train", action="store_true", help="Do not benchmark the training step")
+    parser.add_argument("--out", type=str, default="bench_results.json", help="File to write the results to")
+    parser.add_argument("--baseline", type=str, help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed tokens/sec drop against the baseline")
+    args = parser.parse_args()
+
+    results = run(args)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        results["regressions"] = regressions
+
+    with open(args.out, "w", encoding="utf-8") as fp:
+        json.dump(results, fp, indent=2)
+    print(f"wrote {len(results['results'])} results to {args.out}")
+
+    if regressions:
+        raise SystemExit(f"{len(regressions)} regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
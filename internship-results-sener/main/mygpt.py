@@ -1,7 +1,14 @@
+import argparse
+import json
+import os
+
+import numpy as np
 import tiktoken
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, DataLoader
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from torch.utils.data import ConcatDataset, Dataset, DataLoader
 
 # pre-processing: tokenising, creating embeddings etc.
 
@@ -23,13 +30,70 @@ class GPTDataset(Dataset):
     def __getitem__(self, index):
         return self.input_ids[index], self.target_ids[index]
 
-def create_dataloader(txt, batch_size=4, max_length=256, stride=128,
-        shuffle=True, drop_last=True, num_workers=0):
+def write_token_file(txt, tokeniser, token_path):
+    # tokenise once and store the ids as a flat uint16 file (gpt2's 50257 ids fit in 16 bits)
+    token_ids = np.asarray(tokeniser.encode(txt, allowed_special={"<|endoftext|>"}), dtype=np.int64)
+    assert token_ids.size == 0 or token_ids.max() < 2**16, "token ids do not fit in uint16"
+    token_ids.astype(np.uint16).tofile(token_path)
+    return token_ids.size
+
+
+class GPTMemmapDataset(Dataset):
+    # same windows as GPTDataset, but served as views into a memory-mapped token file, so the
+    # corpus is stored once on disk and the page cache is shared by all DataLoader workers
+    def __init__(self, token_path, max_length, stride) -> None:
+        self.token_path = token_path
+        self.max_length = max_length
+        self.stride = stride
+        self.num_tokens = os.path.getsize(token_path) // np.dtype(np.uint16).itemsize
+        self._tokens = None  # mapped lazily, so each worker opens its own map instead of unpickling one
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        return state
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = np.memmap(self.token_path, dtype=np.uint16, mode="r")
+        return self._tokens
+
+    def __len__(self):
+        return len(range(0, self.num_tokens - self.max_length, self.stride))
+
+    def __getitem__(self, index):
+        start = index * self.stride
+        # one (max_length + 1) slice covers both input and target; embeddings need int64 ids
+        chunk = torch.from_numpy(self.tokens[start:start + self.max_length + 1].astype(np.int64))
+        return chunk[:-1], chunk[1:]
+
+
+def create_dataset(txt, max_length=256, stride=128, token_path=None):
     # Initialize the tokenizer
     tokenizer = tiktoken.get_encoding("gpt2")
 
+    if token_path is None:
+        dataset = GPTDataset(txt, tokenizer, max_length, stride)
+    elif os.path.isdir(token_path):
+        # shards written by tokenise_corpus.py; windows do not cross shard boundaries
+        with open(os.path.join(token_path, "index.json"), "r", encoding="utf-8") as fp:
+            index = json.load(fp)
+        dataset = ConcatDataset([
+            GPTMemmapDataset(os.path.join(token_path, shard["file"]), max_length, stride)
+            for shard in index["shards"]])
+    else:
+        # memory-mapped mode: txt may be None to reuse a token file written by an earlier run
+        if txt is not None:
+            write_token_file(txt, tokenizer, token_path)
+        dataset = GPTMemmapDataset(token_path, max_length, stride)
+    return dataset
+
+
+def create_dataloader(txt, batch_size=4, max_length=256, stride=128,
+        shuffle=True, drop_last=True, num_workers=0, token_path=None):
     # Create dataset
-    dataset = GPTDataset(txt, tokenizer, max_length, stride)
+    dataset = create_dataset(txt, max_length, stride, token_path)
 
     # Create dataloader
     dataloader = DataLoader(
@@ -38,47 +102,130 @@ def create_dataloader(txt, batch_size=4, max_length=256, stride=128,
 
     return dataloader
 
+GPT_CONFIG_124M = {
+    "vocab_size": 50257,     # Vocabulary size
+    "context_length": 1024,  # Context length
+    "emb_dim": 768,          # Embedding dimension
+    "n_heads": 12,           # Number of attention heads
+    "n_layers": 12,          # Number of layers
+    "drop_rate": 0.1,        # Dropout rate
+    "qkv_bias": False,       # Query-Key-Value bias
+    "attn_backend": "sdpa"   # Attention kernel: "sdpa" (fused) or "eager" (reference)
+}
+
+
 # multihead attention module
 
 class MultiHeadAttention(nn.Module):
-    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False):
+    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False,
+            attn_backend="sdpa"):
         super().__init__()
         assert d_out % num_heads == 0, "d_out must be divisible by num_heads"
+        assert attn_backend in ("sdpa", "eager"), "attn_backend must be 'sdpa' or 'eager'"
 
         self.d_out = d_out
         self.num_heads = num_heads
         self.head_dim = d_out // num_heads  # reduce the projection dim to match desired output dim
+        # "sdpa" uses the fused torch kernel, "eager" is the explicit reference implementation
+        self.attn_backend = attn_backend
 
-        self.W_query = nn.Linear(d_in, d_out, bias=qkv_bias)
-        self.W_key = nn.Linear(d_in, d_out, bias=qkv_bias)
-        self.W_value = nn.Linear(d_in, d_out, bias=qkv_bias)
+        # queries, keys and values packed into one projection so they come out of a single matmul
+        self.W_qkv = nn.Linear(d_in, 3 * d_out, bias=qkv_bias)
         self.out_proj = nn.Linear(d_out, d_out)  # linear layer to combine head outputs
         self.dropout = nn.Dropout(dropout)
-        self.register_buffer("mask", torch.triu(torch.ones(context_length, context_length), diagonal=1))
-
-    def forward(self, x):
+        # stored as boolean once, instead of converting on every forward call
+        self.register_buffer("mask", torch.triu(torch.ones(context_length, context_length, dtype=torch.bool), diagonal=1))
+
+        # key/value cache for incremental decoding, allocated lazily on the first cached call
+        self.context_length = context_length
+        self.cache_k = None
+        self.cache_v = None
+        self.cache_len = 0
+
+    def reset_cache(self):
+        self.cache_k = None
+        self.cache_v = None
+        self.cache_len = 0
+
+    def select_cache_rows(self, rows):
+        # keep only the given batch rows, e.g. once other sequences have finished generating
+        if self.cache_k is not None:
+            self.cache_k = self.cache_k[rows]
+            self.cache_v = self.cache_v[rows]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved before the packed projection hold separate W_query/W_key/W_value
+        for suffix in ("weight", "bias"):
+            names = [f"{prefix}W_{name}.{suffix}" for name in ("query", "key", "value")]
+            if all(name in state_dict for name in names):
+                state_dict[f"{prefix}W_qkv.{suffix}"] = torch.cat([state_dict.pop(name) for name in names], dim=0)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def forward(self, x, use_cache=False, pad_lens=None):
         b, num_tokens, d_in = x.shape
 
-        keys = self.W_key(x)  # Shape: (b, num_tokens, d_out)
-        queries = self.W_query(x)
-        values = self.W_value(x)
+        qkv = self.W_qkv(x)  # Shape: (b, num_tokens, 3 * d_out)
+
+        # implicitly split the matrix by adding `qkv` and `num_heads` dimensions
+        # unroll last dim: (b, num_tokens, 3 * d_out) -> (b, num_tokens, 3, num_heads, head_dim)
+        qkv = qkv.view(b, num_tokens, 3, self.num_heads, self.head_dim)
+
+        # permute: -> (3, b, num_heads, num_tokens, head_dim), then split into the three tensors
+        queries, keys, values = qkv.permute(2, 0, 3, 1, 4).unbind(0)
+
+        # with the cache on, the new keys/values are written after the ones already cached
+        # and the queries attend to the whole cached prefix
+        start = 0
+        if use_cache:
+            start = self.cache_len
+            end = start + num_tokens
+            assert end <= self.context_length, "kv cache is full, call reset_cache() first"
+            if self.cache_k is None or self.cache_k.shape[0] != b:
+                shape = (b, self.num_heads, self.context_length, self.head_dim)
+                self.cache_k = keys.new_empty(shape)
+                self.cache_v = values.new_empty(shape)
+            self.cache_k[:, :, start:end] = keys
+            self.cache_v[:, :, start:end] = values
+            self.cache_len = end
+            keys = self.cache_k[:, :, :end]
+            values = self.cache_v[:, :, :end]
+        num_keys = keys.shape[2]
+
+        if self.attn_backend == "sdpa":
+            context_vec = self._sdpa_attention(queries, keys, values, start, pad_lens)
+        else:
+            context_vec = self._eager_attention(queries, keys, values, start, pad_lens)
 
-        # implicitly split the matrix by adding a `num_heads` dimension
-        # unroll last dim: (b, num_tokens, d_out) -> (b, num_tokens, num_heads, head_dim)
-        keys = keys.view(b, num_tokens, self.num_heads, self.head_dim)
-        values = values.view(b, num_tokens, self.num_heads, self.head_dim)
-        queries = queries.view(b, num_tokens, self.num_heads, self.head_dim)
+        # shape: (b, num_tokens, num_heads, head_dim)
+        context_vec = context_vec.transpose(1, 2)
 
-        # transpose: (b, num_tokens, num_heads, head_dim) -> (b, num_heads, num_tokens, head_dim)
-        keys = keys.transpose(1, 2)
-        queries = queries.transpose(1, 2)
-        values = values.transpose(1, 2)
+        # combine heads, where self.d_out = self.num_heads * self.head_dim
+        context_vec = context_vec.contiguous().view(b, num_tokens, self.d_out)
+        context_vec = self.out_proj(context_vec)  # optional projection
+
+        return context_vec
+
+    def _attention_mask(self, start, num_tokens, num_keys, pad_lens):
+        # causal mask truncated to the query/key positions, shape (num_tokens, num_keys)
+        mask_bool = self.mask[start:start + num_tokens, :num_keys]
+        if pad_lens is None:
+            return mask_bool
+
+        # left-padded batch: additionally hide the first pad_lens[i] keys of row i, shape
+        # (b, 1, num_tokens, num_keys). Pad queries still see themselves, so that no row is
+        # fully masked (that would turn into NaNs which then leak through the values)
+        key_pos = torch.arange(num_keys, device=pad_lens.device)
+        query_pos = torch.arange(start, start + num_tokens, device=pad_lens.device)
+        is_pad = (key_pos[None, None, :] < pad_lens[:, None, None]) & (key_pos[None, None, :] != query_pos[None, :, None])
+        return (mask_bool[None] | is_pad)[:, None]
+
+    def _eager_attention(self, queries, keys, values, start, pad_lens=None):
+        num_tokens, num_keys = queries.shape[2], keys.shape[2]
 
         # compute scaled dot-product attention (aka self-attention) with a causal mask
         attn_scores = queries @ keys.transpose(2, 3)  # dot product for each head
 
-        # original mask truncated to the number of tokens and converted to boolean
-        mask_bool = self.mask.bool()[:num_tokens, :num_tokens]
+        mask_bool = self._attention_mask(start, num_tokens, num_keys, pad_lens)
 
         # use the mask to fill attention scores
         attn_scores.masked_fill_(mask_bool, -torch.inf)
@@ -86,14 +233,25 @@ class MultiHeadAttention(nn.Module):
         attn_weights = torch.softmax(attn_scores / keys.shape[-1]**0.5, dim=-1)
         attn_weights = self.dropout(attn_weights)
 
-        # shape: (b, num_tokens, num_heads, head_dim)
-        context_vec = (attn_weights @ values).transpose(1, 2)
+        return attn_weights @ values
 
-        # combine heads, where self.d_out = self.num_heads * self.head_dim
-        context_vec = context_vec.contiguous().view(b, num_tokens, self.d_out)
-        context_vec = self.out_proj(context_vec)  # optional projection
+    def _sdpa_attention(self, queries, keys, values, start, pad_lens=None):
+        # fused kernel: scaling, masking, softmax and dropout without materialising the
+        # (b, num_heads, num_tokens, num_keys) score matrix where the backend allows it
+        num_tokens, num_keys = queries.shape[2], keys.shape[2]
+        dropout_p = self.dropout.p if self.training else 0.0
 
-        return context_vec
+        if pad_lens is None:
+            if num_tokens == num_keys:
+                return F.scaled_dot_product_attention(queries, keys, values, dropout_p=dropout_p, is_causal=True)
+            if num_tokens == 1:
+                # a single new query sits at the last position and may attend to every cached key
+                return F.scaled_dot_product_attention(queries, keys, values, dropout_p=dropout_p)
+
+        # several new queries on top of a cached prefix (is_causal would align the mask to the
+        # top-left corner) or a padded batch: pass the mask explicitly (True = may attend)
+        attn_mask = ~self._attention_mask(start, num_tokens, num_keys, pad_lens)
+        return F.scaled_dot_product_attention(queries, keys, values, attn_mask=attn_mask, dropout_p=dropout_p)
 
 # main structure of gpt-based llm
 class LayerNorm(nn.Module):
@@ -143,17 +301,18 @@ class TransformerBlock(nn.Module):
             context_length=cfg["context_length"],
             num_heads=cfg["n_heads"],
             dropout=cfg["drop_rate"],
-            qkv_bias=cfg["qkv_bias"])
+            qkv_bias=cfg["qkv_bias"],
+            attn_backend=cfg.get("attn_backend", "sdpa"))
         self.ff = FeedForward(cfg)
         self.norm1 = LayerNorm(cfg["emb_dim"])
         self.norm2 = LayerNorm(cfg["emb_dim"])
         self.drop_shortcut = nn.Dropout(cfg["drop_rate"])
 
-    def forward(self, x):
+    def forward(self, x, use_cache=False, pad_lens=None):
         # Shortcut connection for attention block
         shortcut = x
         x = self.norm1(x)
-        x = self.att(x)   # Shape [batch_size, num_tokens, emb_size]
+        x = self.att(x, use_cache=use_cache, pad_lens=pad_lens)   # Shape [batch_size, num_tokens, emb_size]
         x = self.drop_shortcut(x)
         x = x + shortcut  # Add the original input back
 
@@ -174,24 +333,146 @@ class GPTModel(nn.Module):
         self.pos_emb = nn.Embedding(cfg["context_length"], cfg["emb_dim"])
         self.drop_emb = nn.Dropout(cfg["drop_rate"])
 
-        self.trf_blocks = nn.Sequential(
-            *[TransformerBlock(cfg) for _ in range(cfg["n_layers"])])
+        # ModuleList rather than Sequential so that use_cache can be passed to every block
+        self.trf_blocks = nn.ModuleList(
+            [TransformerBlock(cfg) for _ in range(cfg["n_layers"])])
 
         self.final_norm = LayerNorm(cfg["emb_dim"])
         self.out_head = nn.Linear(cfg["emb_dim"], cfg["vocab_size"], bias=False)
 
-    def forward(self, in_idx):
+        # position of the next token to be fed through the kv cache
+        self.current_pos = 0
+
+        # recompute each block's activations in the backward pass instead of storing them
+        self.activation_checkpointing = cfg.get("activation_checkpointing", False)
+
+    def reset_kv_cache(self):
+        for block in self.trf_blocks:
+            block.att.reset_cache()
+        self.current_pos = 0
+
+    def select_kv_cache_rows(self, rows):
+        for block in self.trf_blocks:
+            block.att.select_cache_rows(rows)
+
+    def forward(self, in_idx, use_cache=False, pad_lens=None):
+        # pad_lens: optional (batch_size,) number of left-padding tokens in each row
         batch_size, seq_len = in_idx.shape
         tok_embeds = self.tok_emb(in_idx)
-        pos_embeds = self.pos_emb(torch.arange(seq_len, device=in_idx.device))
+        if use_cache:
+            # positions continue from wherever the cached prefix ended
+            pos_ids = torch.arange(self.current_pos, self.current_pos + seq_len, device=in_idx.device)
+            self.current_pos += seq_len
+        else:
+            pos_ids = torch.arange(seq_len, device=in_idx.device)
+        if pad_lens is not None:
+            # every row starts counting positions at its first real token
+            pos_ids = (pos_ids[None, :] - pad_lens[:, None]).clamp(min=0)
+        pos_embeds = self.pos_emb(pos_ids)
         x = tok_embeds + pos_embeds  # Shape [batch_size, num_tokens, emb_size]
         x = self.drop_emb(x)
-        x = self.trf_blocks(x)
+        for block in self.trf_blocks:
+            if self.activation_checkpointing and self.training:
+                x = checkpoint(block, x, use_cache, pad_lens, use_reentrant=False)
+            else:
+                x = block(x, use_cache=use_cache, pad_lens=pad_lens)
         x = self.final_norm(x)
         logits = self.out_head(x)
         return logits
 
 
+# decoding: logits processors and sampling
+# every processor edits the (rows, vocab_size) logits of the last position in place
+
+class RepetitionPenalty:
+    # CTRL-style penalty on tokens already present in the recent history (ollama's repeat_penalty)
+    def __init__(self, penalty):
+        self.penalty = penalty
+
+    def __call__(self, logits, token_ids):
+        score = torch.gather(logits, 1, token_ids)
+        score = torch.where(score < 0, score * self.penalty, score / self.penalty)
+        return logits.scatter_(1, token_ids, score)
+
+
+class Temperature:
+    def __init__(self, temperature):
+        self.temperature = temperature
+
+    def __call__(self, logits, token_ids):
+        return logits.div_(self.temperature)
+
+
+class TopK:
+    def __init__(self, top_k):
+        self.top_k = top_k
+
+    def __call__(self, logits, token_ids):
+        k = min(self.top_k, logits.shape[-1])
+        kth_largest = torch.topk(logits, k, dim=-1).values[:, -1:]
+        return logits.masked_fill_(logits < kth_largest, -torch.inf)
+
+
+class TopP:
+    # nucleus sampling: keep the smallest set of tokens whose probabilities add up to top_p
+    def __init__(self, top_p):
+        self.top_p = top_p
+
+    def __call__(self, logits, token_ids):
+        sorted_logits, sorted_idx = torch.sort(logits, dim=-1, descending=True)
+        sorted_probs = torch.softmax(sorted_logits, dim=-1)
+        # a token is dropped if the tokens ranked above it already reach top_p (so the first one never is)
+        drop = (sorted_probs.cumsum(dim=-1) - sorted_probs) >= self.top_p
+        return logits.scatter_(1, sorted_idx, sorted_logits.masked_fill_(drop, -torch.inf))
+
+
+class Sampler:
+    # picks the next token from the last-position logits. With temperature 0 (the default) it
+    # is greedy argmax, otherwise it samples after running the processors in the same order as
+    # ollama/transformers: repetition penalty, temperature, top-k, top-p. A seed makes the
+    # draws reproducible independently of the global torch RNG
+    def __init__(self, temperature=0.0, top_k=None, top_p=None, repetition_penalty=None,
+            repeat_last_n=64, seed=None, device="cpu"):
+        self.greedy = not temperature
+        self.repeat_last_n = repeat_last_n
+
+        self.processors = []
+        if repetition_penalty and repetition_penalty != 1.0:
+            self.processors.append(RepetitionPenalty(repetition_penalty))
+        if not self.greedy:
+            self.processors.append(Temperature(temperature))
+            if top_k:
+                self.processors.append(TopK(top_k))
+            if top_p is not None and top_p < 1.0:
+                self.processors.append(TopP(top_p))
+
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator(device=device)
+            self.generator.manual_seed(seed)
+
+    @property
+    def needs_history(self):
+        return any(isinstance(processor, RepetitionPenalty) for processor in self.processors)
+
+    def __call__(self, logits, token_ids=None):
+        # logits: (rows, vocab_size), token_ids: (rows, n) recent tokens, only read by the penalty
+        for processor in self.processors:
+            logits = processor(logits, token_ids)
+        if self.greedy:
+            return torch.argmax(logits, dim=-1, keepdim=True)  # (rows, 1)
+        probs = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probs, num_samples=1, generator=self.generator)  # (rows, 1)
+
+
+def recent_tokens(sequences, last_n):
+    # (rows, n) tensor of the last_n tokens of each sequence. Shorter rows are padded with a repeat
+    # of their own last token, which leaves the penalty unchanged as it only looks at which ids occur
+    window = [list(seq[-last_n:]) for seq in sequences]
+    longest = max(len(seq) for seq in window)
+    return torch.tensor([seq + seq[-1:] * (longest - len(seq)) for seq in window])
+
+
 def generate_text_simple(model, idx, max_new_tokens, context_size):
     # idx is (B, T) array of indices in the current context
     for _ in range(max_new_tokens):
@@ -218,20 +499,290 @@ def generate_text_simple(model, idx, max_new_tokens, context_size):
     return idx
 
 
-def main():
-    GPT_CONFIG_124M = {
-        "vocab_size": 50257,     # Vocabulary size
-        "context_length": 1024,  # Context length
-        "emb_dim": 768,          # Embedding dimension
-        "n_heads": 12,           # Number of attention heads
-        "n_layers": 12,          # Number of layers
-        "drop_rate": 0.1,        # Dropout rate
-        "qkv_bias": False        # Query-Key-Value bias
+def generate_text_cached(model, idx, max_new_tokens, context_size, sampler=None):
+    # same decoding as generate_text_simple, but the prompt is run through the model once
+    # (prefill) and afterwards only the newest token is fed, reusing the cached keys/values.
+    # Greedy unless a Sampler is given
+    sampler = sampler or Sampler()
+    context_size = min(context_size, model.pos_emb.num_embeddings)
+
+    model.reset_kv_cache()
+    with torch.no_grad():
+        logits = model(idx[:, -context_size:], use_cache=True)
+
+        for step in range(max_new_tokens):
+            history = idx[:, -sampler.repeat_last_n:] if sampler.needs_history else None
+            idx_next = sampler(logits[:, -1, :], history).to(idx.device)  # (batch, 1)
+            idx = torch.cat((idx, idx_next), dim=1)  # (batch, n_tokens+1)
+
+            if step == max_new_tokens - 1:
+                break
+
+            if model.current_pos >= context_size:
+                # absolute positions are baked into the cached keys, so they cannot be shifted
+                # when the window slides; re-prefill the most recent half window instead, which
+                # leaves room for context_size // 2 more cheap decode steps
+                model.reset_kv_cache()
+                logits = model(idx[:, -max(1, context_size // 2):], use_cache=True)
+            else:
+                logits = model(idx_next, use_cache=True)
+
+    model.reset_kv_cache()
+    return idx
+
+
+def left_pad(sequences, pad_id):
+    # (batch, longest) tensor with the sequences right-aligned, plus the padding length of each row
+    longest = max(len(seq) for seq in sequences)
+    pad_lens = torch.tensor([longest - len(seq) for seq in sequences])
+    idx = torch.tensor([[pad_id] * (longest - len(seq)) + list(seq) for seq in sequences])
+    return idx, pad_lens
+
+
+def generate_batch(model, prompts, tokenizer, max_new_tokens, context_size,
+        stop_strings=None, eos_id=None, sampler=None):
+    # prompts of different lengths are left-padded into one batch and decoded together through
+    # the kv cache. A sequence is retired, and dropped from the batch, as soon as it emits eos_id
+    # or one of stop_strings shows up in its output. Returns one dict per prompt, in prompt order
+    eos_id = tokenizer.eot_token if eos_id is None else eos_id
+    sampler = sampler or Sampler()
+    stop_strings = stop_strings or []
+    context_size = min(context_size, model.pos_emb.num_embeddings)
+    device = next(model.parameters()).device
+
+    # an empty prompt is conditioned on <|endoftext|>, as GPT-2 does for unconditional samples
+    prompt_ids = [tokenizer.encode(prompt, allowed_special={"<|endoftext|>"}) or [eos_id] for prompt in prompts]
+    generated = [[] for _ in prompts]
+    results = [None] * len(prompts)
+    active = list(range(len(prompts)))  # prompt index of each row in the running batch
+
+    def prefill(window):
+        model.reset_kv_cache()
+        idx, pad_lens = left_pad([(prompt_ids[i] + generated[i])[-window:] for i in active], eos_id)
+        idx, pad_lens = idx.to(device), pad_lens.to(device)
+        return model(idx, use_cache=True, pad_lens=pad_lens), pad_lens
+
+    def finish(i, reason):
+        token_ids = generated[i][:-1] if reason == "eos" else generated[i]
+        text = tokenizer.decode(token_ids)
+        if reason == "stop":
+            text = text[:min(text.find(stop) for stop in stop_strings if stop in text)]
+        return {"text": text, "token_ids": token_ids, "finish_reason": reason}
+
+    with torch.no_grad():
+        logits, pad_lens = prefill(context_size)
+
+        for step in range(max_new_tokens):
+            history = None
+            if sampler.needs_history:
+                history = recent_tokens([prompt_ids[i] + generated[i] for i in active], sampler.repeat_last_n).to(device)
+            idx_next = sampler(logits[:, -1, :], history)[:, 0]  # (rows,)
+
+            keep = []
+            for row, token in enumerate(idx_next.tolist()):
+                i = active[row]
+                generated[i].append(token)
+                if token == eos_id:
+                    results[i] = finish(i, "eos")
+                elif stop_strings and any(stop in tokenizer.decode(generated[i]) for stop in stop_strings):
+                    results[i] = finish(i, "stop")
+                else:
+                    keep.append(row)
+
+            if not keep or step == max_new_tokens - 1:
+                break
+
+            if len(keep) < len(active):
+                rows = torch.tensor(keep, device=device)
+                model.select_kv_cache_rows(rows)
+                pad_lens = pad_lens[rows]
+                idx_next = idx_next[rows]
+                active = [active[row] for row in keep]
+
+            if model.current_pos >= context_size:
+                # window is full, see generate_text_cached
+                logits, pad_lens = prefill(max(1, context_size // 2))
+            else:
+                logits = model(idx_next[:, None], use_cache=True, pad_lens=pad_lens)
+
+    model.reset_kv_cache()
+    for i in range(len(prompts)):
+        if results[i] is None:
+            results[i] = finish(i, "length")
+    return results
+
+
+# checkpoints and cpu inference
+
+# number of attention heads of the released GPT-2 sizes, keyed by embedding dimension
+GPT2_HEADS = {768: 12, 1024: 16, 1280: 20, 1600: 25}
+
+
+def open_checkpoint(checkpoint_path):
+    # returns name -> tensor for a .safetensors or torch.save'd checkpoint without reading it
+    # into memory up front: safetensors tensors are loaded on access, torch files are mmapped
+    if checkpoint_path.endswith(".safetensors"):
+        try:
+            from safetensors.torch import safe_open
+        except ImportError:
+            raise SystemExit("Loading .safetensors checkpoints needs the safetensors package (pip install safetensors)")
+        handle = safe_open(checkpoint_path, framework="pt", device="cpu")
+        return {name: LazyTensor(handle, name) for name in handle.keys()}
+    return torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+
+
+class LazyTensor:
+    def __init__(self, handle, name):
+        self.handle = handle
+        self.name = name
+        self.shape = tuple(handle.get_slice(name).get_shape())
+
+    def load(self):
+        return self.handle.get_tensor(self.name)
+
+
+def _materialise(tensor):
+    return tensor.load() if isinstance(tensor, LazyTensor) else tensor
+
+
+def gpt2_config(tensors, **overrides):
+    # infers the GPTModel config from the shapes of a Hugging Face GPT-2 checkpoint
+    tensors = {name.removeprefix("transformer."): tensor for name, tensor in tensors.items()}
+    vocab_size, emb_dim = tensors["wte.weight"].shape
+    cfg = {
+        "vocab_size": vocab_size,
+        "context_length": tensors["wpe.weight"].shape[0],
+        "emb_dim": emb_dim,
+        "n_heads": GPT2_HEADS[emb_dim],
+        "n_layers": len({name.split(".")[1] for name in tensors if name.startswith("h.")}),
+        "drop_rate": 0.0,
+        "qkv_bias": True,
+        "attn_backend": "sdpa",
     }
+    cfg.update(overrides)
+    return cfg
+
+
+def gptmodel_config(tensors, **overrides):
+    # infers the config of a bare GPTModel state_dict from its shapes; the number of heads is not
+    # visible in the weights, so it is taken from the GPT-2 size with the same embedding dimension
+    vocab_size, emb_dim = tensors["tok_emb.weight"].shape
+    assert emb_dim in GPT2_HEADS or "n_heads" in overrides, f"cannot infer n_heads for emb_dim {emb_dim}"
+    cfg = {
+        "vocab_size": vocab_size,
+        "context_length": tensors["pos_emb.weight"].shape[0],
+        "emb_dim": emb_dim,
+        "n_heads": GPT2_HEADS.get(emb_dim),
+        "n_layers": len({name.split(".")[1] for name in tensors if name.startswith("trf_blocks.")}),
+        "drop_rate": 0.0,
+        "qkv_bias": "trf_blocks.0.att.W_qkv.bias" in tensors,
+        "attn_backend": "sdpa",
+    }
+    cfg.update(overrides)
+    return cfg
+
+
+def gpt2_state_dict(tensors, n_layers):
+    # maps Hugging Face GPT-2 names onto GPTModel names. GPT-2 stores its projections as Conv1D,
+    # i.e. (in, out), so they are transposed; c_attn is already packed in q, k, v order like W_qkv,
+    # and the output head is tied to the token embedding
+    tensors = {name.removeprefix("transformer."): tensor for name, tensor in tensors.items()}
+
+    def get(name, transpose=False):
+        tensor = _materialise(tensors[name])
+        return tensor.t() if transpose else tensor
+
+    state_dict = {
+        "tok_emb.weight": get("wte.weight"),
+        "pos_emb.weight": get("wpe.weight"),
+        "final_norm.scale": get("ln_f.weight"),
+        "final_norm.shift": get("ln_f.bias"),
+    }
+    state_dict["out_head.weight"] = state_dict["tok_emb.weight"]
+
+    for i in range(n_layers):
+        src, dst = f"h.{i}.", f"trf_blocks.{i}."
+        state_dict.update({
+            dst + "att.W_qkv.weight": get(src + "attn.c_attn.weight", transpose=True),
+            dst + "att.W_qkv.bias": get(src + "attn.c_attn.bias"),
+            dst + "att.out_proj.weight": get(src + "attn.c_proj.weight", transpose=True),
+            dst + "att.out_proj.bias": get(src + "attn.c_proj.bias"),
+            dst + "ff.layers.0.weight": get(src + "mlp.c_fc.weight", transpose=True),
+            dst + "ff.layers.0.bias": get(src + "mlp.c_fc.bias"),
+            dst + "ff.layers.2.weight": get(src + "mlp.c_proj.weight", transpose=True),
+            dst + "ff.layers.2.bias": get(src + "mlp.c_proj.bias"),
+            dst + "norm1.scale": get(src + "ln_1.weight"),
+            dst + "norm1.shift": get(src + "ln_1.bias"),
+            dst + "norm2.scale": get(src + "ln_2.weight"),
+            dst + "norm2.shift": get(src + "ln_2.bias"),
+        })
+    return state_dict
+
+
+def load_gpt_model(checkpoint_path, cfg=None, **overrides):
+    # builds a GPTModel from a pretrained GPT-2 checkpoint (Hugging Face names), a checkpoint.pt
+    # written by train_gpt.py (which stores its cfg) or a bare GPTModel state_dict, whose cfg is
+    # inferred from the shapes unless given. The tensors are assigned rather than copied, so
+    # weights from an mmapped torch file stay backed by the file
+    tensors = open_checkpoint(checkpoint_path)
+    if "model" in tensors and "cfg" in tensors:
+        # training checkpoint: {"model", "cfg", "optimizer", "scheduler", ...}
+        cfg = cfg or tensors["cfg"]
+        tensors = tensors["model"]
+
+    if "tok_emb.weight" in tensors:
+        cfg = {**cfg, **overrides} if cfg is not None else gptmodel_config(tensors, **overrides)
+        state_dict = {name: _materialise(tensor) for name, tensor in tensors.items()}
+    else:
+        cfg = cfg or gpt2_config(tensors, **overrides)
+        state_dict = gpt2_state_dict(tensors, cfg["n_layers"])
+
+    # built on the meta device, so no memory is spent on random weights that get replaced anyway
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    missing, unexpected = model.load_state_dict(state_dict, strict=False, assign=True)
+    assert not unexpected, f"unexpected weights in checkpoint: {unexpected}"
+    assert all(name.endswith("att.mask") for name in missing), f"missing weights in checkpoint: {missing}"
+
+    # keep the output head tied to the token embedding as one parameter, as GPT-2 trains it
+    if state_dict["out_head.weight"] is state_dict["tok_emb.weight"]:
+        model.out_head.weight = model.tok_emb.weight
+
+    # the causal masks are buffers that GPT-2 checkpoints do not carry, so they are rebuilt
+    for block in model.trf_blocks:
+        n = cfg["context_length"]
+        block.att.mask = torch.triu(torch.ones(n, n, dtype=torch.bool), diagonal=1)
+
+    model.eval()
+    return model, cfg
+
+
+def quantize_int8(model):
+    # int8 dynamic quantisation for cpu inference: the weights of every nn.Linear (W_qkv and
+    # out_proj in MultiHeadAttention, the FeedForward layers and out_head) are stored as int8 and
+    # activations are quantised on the fly, so the matmuls run on int8 kernels. Inference only
+    model.eval()
+    # in place, so the float weights are not deep-copied first (that would double peak memory and
+    # undo loading them lazily from the checkpoint)
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate text with GPTModel")
+    # optional flags
+    parser.add_argument("--checkpoint", type=str, help="Checkpoint to load instead of random weights: GPT-2 (model.safetensors or pytorch_model.bin), train_gpt.py's checkpoint.pt or a GPTModel state_dict")
+    parser.add_argument("--int8", action="store_true", help="Run with int8 dynamically quantised linear layers")
+    args = parser.parse_args()
 
     torch.manual_seed(123)
-    model = GPTModel(GPT_CONFIG_124M)
+    if args.checkpoint:
+        model, cfg = load_gpt_model(args.checkpoint)
+    else:
+        cfg = GPT_CONFIG_124M
+        model = GPTModel(cfg)
     model.eval()  # disable dropout
+    if args.int8:
+        model = quantize_int8(model)
 
     start_context = "Hello, I am"
 
@@ -244,11 +795,11 @@ def main():
     print("Encoded input text:", encoded)
     print("encoded_tensor.shape:", encoded_tensor.shape)
 
-    out = generate_text_simple(
+    out = generate_text_cached(
         model=model,
         idx=encoded_tensor,
         max_new_tokens=10,
-        context_size=GPT_CONFIG_124M["context_length"]
+        context_size=cfg["context_length"]
     )
     decoded_text = tokenizer.decode(out.squeeze(0).tolist())
 
@@ -0,0 +1,89 @@
+"""
+Semantic answer cache for ragapp.
+
+Answers are looked up first by the normalised question text and then by the cosine similarity
+of the question embedding to the cached questions, so rephrasings of an FAQ-style question
+skip retrieval and generation. Entries expire after ttl seconds, the least recently used
+entry is evicted beyond max_entries, and the whole cache is cleared when the document index
+version changes.
+
+Usage example:
+answer_cache = AnswerCache(embedding_func, max_entries=256, ttl=3600, similarity_threshold=0.95)
+answer = answer_cache.get(question)
+if answer is None:
+    answer = st.write_stream(server.stream(question))
+    answer_cache.put(question, answer)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalise_question(question):
+    return " ".join(question.lower().split())
+
+
+class AnswerCache:
+    def __init__(self, embedding_func, max_entries=256, ttl=3600, similarity_threshold=0.95) -> None:
+        self.embedding_func = embedding_func
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.index_version = None
+        # normalised question -> (unit question vector, answer, time stored); order is least to most recently used
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set_index_version(self, version):
+        # answers were generated from the old documents, so they are dropped when the index changes
+        with self.lock:
+            if version != self.index_version:
+                self.entries.clear()
+                self.index_version = version
+
+    def embed(self, question):
+        vector = np.asarray(self.embedding_func.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def expire(self, now):
+        for key in [key for key, (_, _, stored) in self.entries.items() if now - stored > self.ttl]:
+            del self.entries[key]
+
+    def get(self, question):
+        key = normalise_question(question)
+        with self.lock:
+            self.expire(time.monotonic())
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+            if not self.entries:
+                return None
+            keys = list(self.entries.keys())
+            vectors = np.stack([self.entries[k][0] for k in keys])
+
+        # embedding is done outside the lock, it is the slow part of a lookup
+        similarities = vectors @ self.embed(question)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        with self.lock:
+            entry = self.entries.get(keys[best])
+            if entry is None:  # evicted meanwhile
+                return None
+            self.entries.move_to_end(keys[best])
+            return entry[1]
+
+    def put(self, question, answer):
+        key = normalise_question(question)
+        vector = self.embed(question)
+        with self.lock:
+            self.entries[key] = (vector, answer, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,136 @@
+"""
+Batched, cached sentence-transformer embeddings for ragapp.
+
+CachedEmbeddings is a drop-in replacement for SentenceTransformerEmbeddings: texts are
+de-duplicated, looked up in an on-disk cache keyed by the sha256 of model name + text, and
+only the misses are encoded, in batches of batch_size spread over num_workers threads.
+Vectors are cached as float16 or as int8 with one scale per vector, so ingestion and
+query-time retrieval share the cache and repeated chunks or questions are embedded once.
+
+Usage example:
+embedding_func = CachedEmbeddings("all-MiniLM-L6-v2", cache_dir="./embedding-cache", batch_size=64, num_workers=4)
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
+
+CACHE_DTYPES = ("float16", "int8")
+
+
+def text_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+def encode_vector(vector, dtype):
+    # returns (bytes, scale); int8 uses symmetric per-vector quantisation
+    if dtype == "float16":
+        return vector.astype(np.float16).tobytes(), 1.0
+    scale = float(np.abs(vector).max()) / 127.0 or 1.0
+    return np.round(vector / scale).astype(np.int8).tobytes(), scale
+
+
+def decode_vector(blob, scale, dtype):
+    if dtype == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * scale
+
+
+class EmbeddingCache:
+    # sqlite file with one row per text hash; a single connection guarded by a lock, because
+    # streamlit runs every session in its own thread
+    def __init__(self, path, dtype="float16") -> None:
+        if dtype not in CACHE_DTYPES:
+            raise ValueError(f"dtype must be one of {CACHE_DTYPES}, got {dtype!r}")
+        self.dtype = dtype
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dtype TEXT, scale REAL, vector BLOB)"
+        )
+        self.conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            # sqlite limits the number of bound parameters, so look up in slices
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, dtype, scale, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, dtype, scale, blob in rows:
+                    found[key] = decode_vector(blob, scale, dtype)
+        return found
+
+    def put_many(self, items):
+        rows = []
+        for key, vector in items:
+            blob, scale = encode_vector(vector, self.dtype)
+            rows.append((key, self.dtype, scale, blob))
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, model_name, cache_dir="./embedding-cache", batch_size=64, num_workers=1, dtype="float16",
+                 normalize_embeddings=False) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.normalize_embeddings = normalize_embeddings
+        self.model = SentenceTransformer(model_name)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache = EmbeddingCache(os.path.join(cache_dir, f"{model_name.replace('/', '_')}-{dtype}.sqlite"), dtype)
+        # torch releases the GIL inside its kernels, so threads encode batches in parallel
+        self.pool = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+
+    def encode_batch(self, texts):
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize_embeddings,
+            show_progress_bar=False,
+        )
+
+    def encode(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.pool is None or len(batches) == 1:
+            results = [self.encode_batch(batch) for batch in batches]
+        else:
+            results = list(self.pool.map(self.encode_batch, batches))
+        return np.concatenate(results, axis=0)
+
+    def embed_documents(self, texts):
+        keys = [text_key(self.model_name, text) for text in texts]
+        vectors = self.cache.get_many(list(set(keys)))
+
+        # encode each missing text once, even if it occurs several times in texts
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            encoded = self.encode(list(missing.values()))
+            self.cache.put_many(zip(missing.keys(), encoded))
+            # read back through the cache dtype, so cached and fresh vectors are identical
+            vectors.update(self.cache.get_many(list(missing.keys())))
+
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
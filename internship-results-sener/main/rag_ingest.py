@@ -0,0 +1,57 @@
+"""
+Parallel PDF loading and chunking for ragapp.
+
+PDFs are parsed in a process pool; each worker reads its PDF page by page and splits every
+page into chunks as it is read, so a worker only holds one PDF at a time. The parent keeps at
+most max_pending PDFs in flight and yields their chunks in completion order, so memory stays
+flat regardless of how many PDFs the folder holds. The functions live outside ragapp.py
+because spawned worker processes import the module that defines them, and importing ragapp.py
+would start the streamlit app.
+
+Usage example:
+for pdf_path, splits in load_and_process_pdfs(pdf_paths, max_workers=8):
+    vectorstore.add_documents(splits)
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+
+
+def split_pdf(pdf_path, chunk_size=1000, chunk_overlap=200):
+    # split text into chunks, to keep within input size limits (chunk_size is #chars)
+    # chunk overlap allows us to keep context across chunks
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    splits = []
+    for page in PyPDFLoader(pdf_path).lazy_load():
+        splits.extend(text_splitter.split_documents([page]))
+    return pdf_path, splits
+
+
+def load_and_process_pdfs(pdf_paths, max_workers=None, max_pending=None, chunk_size=1000, chunk_overlap=200):
+    # yields (pdf_path, splits) as PDFs finish parsing; a PDF that fails to parse is reported and skipped
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * max_workers
+    pdf_paths = iter(pdf_paths)
+
+    # spawn rather than fork: by now the streamlit process runs several threads (and has torch
+    # loaded), which a forked child would inherit in whatever state they were in
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = set()
+        while True:
+            # top up to max_pending, so parsed-but-unconsumed PDFs cannot pile up in memory
+            for pdf_path in pdf_paths:
+                pending.add(pool.submit(split_pdf, pdf_path, chunk_size, chunk_overlap))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    yield future.result()
+                except Exception as e:
+                    print(f"Skipping PDF that could not be parsed: {e}")
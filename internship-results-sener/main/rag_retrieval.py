@@ -0,0 +1,149 @@
+"""
+Hybrid BM25 + vector retrieval for ragapp.
+
+BM25Index is an in-memory inverted index over the chunks stored in Chroma, so exact-term
+queries (GAML keywords, model names) are found even when their embeddings are not close.
+HybridRetriever merges the BM25 and vector rankings with reciprocal rank fusion, optionally
+reranks the fused candidates with a cross-encoder, and keeps chunks only while they fit in
+max_context_tokens, so the prompt sent to the LLM stays small.
+
+Usage example:
+bm25 = BM25Index.from_vectorstore(vectorstore)
+retriever = HybridRetriever(vectorstore, bm25, top_k=4, max_context_tokens=1500)
+docs = retriever.retrieve("How do I declare a species in GAML?")
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def approx_token_count(text):
+    # about 4 characters per token for English text with llama / GPT tokenisers
+    return max(1, len(text) // 4)
+
+
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {chunk id: term frequency}
+        self.doc_lengths = {}  # chunk id -> number of terms
+        self.docs = {}  # chunk id -> Document
+        self.total_length = 0
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore, batch_size=5000, **kwargs):
+        # reads the chunks back from chroma in pages, so the index always matches what is stored there
+        index = cls(**kwargs)
+        offset = 0
+        while True:
+            stored = vectorstore.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not stored["ids"]:
+                return index
+            docs = [Document(page_content=text, metadata=metadata or {})
+                    for text, metadata in zip(stored["documents"], stored["metadatas"])]
+            index.add(stored["ids"], docs)
+            offset += len(stored["ids"])
+
+    def add(self, ids, docs):
+        for chunk_id, doc in zip(ids, docs):
+            if chunk_id in self.docs:
+                self.remove([chunk_id])
+            terms = Counter(tokenize(doc.page_content))
+            for term, frequency in terms.items():
+                self.postings[term][chunk_id] = frequency
+            length = sum(terms.values())
+            self.doc_lengths[chunk_id] = length
+            self.total_length += length
+            self.docs[chunk_id] = doc
+
+    def remove(self, ids):
+        for chunk_id in ids:
+            doc = self.docs.pop(chunk_id, None)
+            if doc is None:
+                continue
+            for term in set(tokenize(doc.page_content)):
+                self.postings[term].pop(chunk_id, None)
+                if not self.postings[term]:
+                    del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(chunk_id)
+
+    def search(self, query, k=10):
+        # returns [(chunk id, score)] best first
+        n_docs = len(self.docs)
+        if n_docs == 0:
+            return []
+        avg_length = self.total_length / n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def __len__(self):
+        return len(self.docs)
+
+
+def doc_key(doc):
+    return (doc.metadata.get("source"), doc.metadata.get("page"), doc.page_content)
+
+
+class HybridRetriever:
+    def __init__(self, vectorstore, bm25, k_vector=10, k_bm25=10, top_k=4, rrf_k=60, reranker=None,
+                 max_context_tokens=1500, token_counter=approx_token_count) -> None:
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.k_vector = k_vector
+        self.k_bm25 = k_bm25
+        self.top_k = top_k
+        self.rrf_k = rrf_k
+        # optional sentence_transformers.CrossEncoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+        self.reranker = reranker
+        self.max_context_tokens = max_context_tokens
+        self.token_counter = token_counter
+
+    def fuse(self, query):
+        # reciprocal rank fusion: score = sum over rankings of 1 / (rrf_k + rank)
+        rankings = [
+            self.vectorstore.similarity_search(query, k=self.k_vector),
+            [self.bm25.docs[chunk_id] for chunk_id, _ in self.bm25.search(query, k=self.k_bm25)],
+        ]
+        scores = defaultdict(float)
+        docs = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = doc_key(doc)
+                docs[key] = doc
+                scores[key] += 1.0 / (self.rrf_k + rank + 1)
+        return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def retrieve(self, query):
+        candidates = self.fuse(query)
+        if self.reranker is not None and candidates:
+            scores = self.reranker.predict([(query, doc.page_content) for doc in candidates])
+            candidates = [doc for _, doc in sorted(zip(scores, candidates), key=lambda item: item[0], reverse=True)]
+
+        # keep the best chunks while they fit in the context budget
+        selected = []
+        used_tokens = 0
+        for doc in candidates[:self.top_k]:
+            tokens = self.token_counter(doc.page_content)
+            if selected and used_tokens + tokens > self.max_context_tokens:
+                break
+            selected.append(doc)
+            used_tokens += tokens
+        return selected
@@ -0,0 +1,106 @@
+"""
+Async, streaming serving layer for the RAG assistant.
+
+RAGServer runs one asyncio event loop in a background thread that is shared by every streamlit
+session of the process. Retrieval for each question runs in a thread pool, so many sessions
+retrieve at once, and the answer is streamed token by token from Ollama's /api/generate
+endpoint over a pooled httpx.AsyncClient. A semaphore bounds the number of concurrent
+generations, so the Ollama server is not overloaded; waiting sessions queue on it.
+
+Usage example:
+server = RAGServer(retriever.retrieve, prompt_template, format_docs, model="llama3:8b")
+answer = st.write_stream(server.stream(question))
+"""
+
+import asyncio
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+STREAM_END = object()
+
+
+class RAGServer:
+    def __init__(self, retrieve, prompt_template, format_docs, model="llama3:8b", base_url="http://localhost:11434",
+                 stop=("<|eot_id|>",), max_concurrent_generations=4, retrieval_workers=8, max_connections=16,
+                 timeout=300.0) -> None:
+        self.retrieve = retrieve
+        self.prompt_template = prompt_template
+        self.format_docs = format_docs
+        self.model = model
+        self.stop = list(stop)
+        self.max_concurrent_generations = max_concurrent_generations
+        self.retrieval_pool = ThreadPoolExecutor(max_workers=retrieval_workers)
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        # the client and semaphore are created on the loop they are used from
+        self.client, self.generation_slots = asyncio.run_coroutine_threadsafe(
+            self.start(base_url, max_connections, timeout), self.loop
+        ).result()
+
+    async def start(self, base_url, max_connections, timeout):
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        return client, asyncio.Semaphore(self.max_concurrent_generations)
+
+    async def build_prompt(self, question):
+        docs = await self.loop.run_in_executor(self.retrieval_pool, self.retrieve, question)
+        return self.prompt_template.format(context=self.format_docs(docs), question=question)
+
+    async def generate(self, prompt):
+        # yields the response pieces of ollama's newline-delimited JSON stream
+        payload = {"model": self.model, "prompt": prompt, "stream": True, "options": {"stop": self.stop}}
+        async with self.generation_slots:
+            async with self.client.stream("POST", "/api/generate", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise RuntimeError(chunk["error"])
+                    if chunk.get("response"):
+                        yield chunk["response"]
+                    if chunk.get("done"):
+                        return
+
+    async def answer(self, question):
+        prompt = await self.build_prompt(question)
+        async for token in self.generate(prompt):
+            yield token
+
+    async def pump(self, question, tokens):
+        # forwards tokens to the calling thread; exceptions are forwarded too and re-raised there
+        try:
+            async for token in self.answer(question):
+                tokens.put(token)
+        except Exception as e:
+            tokens.put(e)
+        finally:
+            tokens.put(STREAM_END)
+
+    def stream(self, question):
+        # synchronous generator for streamlit's script thread, e.g. st.write_stream(server.stream(question))
+        tokens = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self.pump(question, tokens), self.loop)
+        try:
+            while (token := tokens.get()) is not STREAM_END:
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+        finally:
+            # the user navigated away or the script was rerun: stop generating for this session
+            future.cancel()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.retrieval_pool.shutdown(wait=False)
@@ -1,59 +1,170 @@
+import hashlib
+import json
 import os
+import time
 from posixpath import split
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.chains import RetrievalQA
 from langchain.memory import ConversationSummaryMemory
 from langchain.prompts import PromptTemplate
-from langchain.llms import Ollama 
 from langchain import hub
-from langchain.callbacks.manager import CallbackManager
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from langchain_core.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 
 import streamlit as st
+from sentence_transformers import CrossEncoder
+
+from rag_answer_cache import AnswerCache
+from rag_embeddings import CachedEmbeddings
+from rag_retrieval import BM25Index, HybridRetriever
+from rag_server import RAGServer
+from rag_ingest import load_and_process_pdfs
+
+PDF_FOLDER = "./news-summaries-pdf"
+# the embedded chunks are kept on disk, so a restart only embeds PDFs that are new or changed
+PERSIST_DIR = "./chroma-db"
+MANIFEST_FILE = "manifest.json"
+EMBEDDING_CACHE_DIR = "./embedding-cache"
+INGEST_BATCH_SIZE = 256  # chunks per chroma write
+MAX_CONTEXT_TOKENS = 1500  # cap on retrieved context put into the prompt
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434")
+MAX_CONCURRENT_GENERATIONS = int(os.environ.get("RAG_MAX_CONCURRENT_GENERATIONS", "4"))
+RERANKER_MODEL = os.environ.get("RAG_RERANKER_MODEL", "")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2, empty to disable
+# RAG_RETRIEVAL_ONLY=1 shows the retrieved chunks and retrieval latency instead of generating an answer
+RETRIEVAL_ONLY = os.environ.get("RAG_RETRIEVAL_ONLY", "0") == "1"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while block := fp.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(persist_dir):
+    # manifest: {file name: {"mtime": ..., "size": ..., "sha256": ..., "ids": [chunk ids in chroma]}}
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+def save_manifest(persist_dir, manifest):
+    # write to a temporary file first, so a crash mid-write does not leave a broken manifest behind
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+def index_version(persist_dir):
+    # changes whenever a PDF is added, changed or removed from the index
+    manifest = load_manifest(persist_dir)
+    contents = json.dumps(sorted((file, entry["sha256"]) for file, entry in manifest.items()))
+    return hashlib.sha256(contents.encode("utf-8")).hexdigest()
+
+def changed_pdfs(folder_path, manifest):
+    # returns (files to (re-)embed with their manifest entry, files that were deleted)
+    # mtime and size are checked first, the file is only hashed when they differ,
+    # so touching a file without changing it does not trigger re-embedding
+    current = {}
+    for file in sorted(os.listdir(folder_path)):
+        if file.endswith('.pdf'):
+            pdf_path = os.path.join(folder_path, file)
+            stat = os.stat(pdf_path)
+            current[file] = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+    changed = {}
+    for file, entry in current.items():
+        old = manifest.get(file)
+        if old is not None and old["mtime"] == entry["mtime"] and old["size"] == entry["size"]:
+            continue
+        entry["sha256"] = file_sha256(os.path.join(folder_path, file))
+        if old is not None and old["sha256"] == entry["sha256"]:
+            # same content, only record the new mtime
+            manifest[file].update(entry)
+            continue
+        changed[file] = entry
+
+    deleted = [file for file in manifest if file not in current]
+    return changed, deleted
 
-# load docs
 # resources need to be loaded in StreamLit cache, else everything will be reloaded for each query
 @st.cache_resource
-def load_and_process_pdfs(folder_path):
-    docs = []
-    for file in os.listdir(folder_path):
-        if file.endswith('.pdf'):
-            pdf_path = os.path.join(folder_path, file)
-            loader = PyPDFLoader(pdf_path)
-            docs.extend(loader.load())
-            
-    # split text into chunks, to keep within input size limits (chunk_size is #chars)
-    # chunk overlap allows us to keep context across chunks       
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000,chunk_overlap=200)
-    splits = text_splitter.split_documents(docs)
-    return splits
+def initialise_vectorstore(folder_path, persist_dir=PERSIST_DIR):
+    os.makedirs(persist_dir, exist_ok=True)
+    vectorstore = Chroma(persist_directory=persist_dir, embedding_function=embedding_func)
+    manifest = load_manifest(persist_dir)
+    changed, deleted = changed_pdfs(folder_path, manifest)
+
+    # remove the chunks of deleted files and the old chunks of changed files
+    stale_ids = []
+    for file in deleted + [file for file in changed if file in manifest]:
+        stale_ids.extend(manifest.pop(file)["ids"])
+    if stale_ids:
+        vectorstore.delete(ids=stale_ids)
+
+    # chunks are streamed into chroma in batches of INGEST_BATCH_SIZE as the PDFs finish parsing
+    batch_docs, batch_ids, batch_files = [], [], []
+
+    def flush():
+        if batch_docs:
+            vectorstore.add_documents(batch_docs, ids=batch_ids)
+        for file in batch_files:
+            manifest[file] = changed[file]
+        # saved after every batch, so an interrupted ingestion resumes where it stopped
+        save_manifest(persist_dir, manifest)
+        batch_docs.clear()
+        batch_ids.clear()
+        batch_files.clear()
+
+    pdf_paths = [os.path.join(folder_path, file) for file in changed]
+    for pdf_path, splits in load_and_process_pdfs(pdf_paths):
+        file = os.path.basename(pdf_path)
+        entry = changed[file]
+        # chunk ids are derived from the file name and content hash, so re-running after a crash overwrites
+        # instead of duplicating, and two copies of the same pdf under different names keep separate chunks
+        key = hashlib.sha256(f"{file}\0{entry['sha256']}".encode("utf-8")).hexdigest()
+        entry["ids"] = [f"{key}-{i}" for i in range(len(splits))]
+        batch_docs.extend(splits)
+        batch_ids.extend(entry["ids"])
+        batch_files.append(file)
+        if len(batch_docs) >= INGEST_BATCH_SIZE:
+            flush()
+
+    flush()
+    return vectorstore
+
+# chroma default embedding model, proven to work
+# chunks and questions are embedded in batches and cached on disk, so repeated text is embedded once
+embedding_func = CachedEmbeddings(
+    model_name="all-MiniLM-L6-v2",
+    cache_dir=EMBEDDING_CACHE_DIR,
+    batch_size=64,
+    num_workers=2,
+    dtype="float16",
+)
+
+vectorstore = initialise_vectorstore(PDF_FOLDER)
 
+# repeated and near-identical questions are answered from the cache instead of retrieving and generating
 @st.cache_resource
-def initialise_vectorstore(_splits):
-    return Chroma.from_documents(splits, embedding=embedding_func)
+def initialise_answer_cache():
+    return AnswerCache(embedding_func, max_entries=256, ttl=3600, similarity_threshold=0.95)
 
-embedding_func = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2") # chroma default embedding model, proven to work
+answer_cache = initialise_answer_cache()
+answer_cache.set_index_version(index_version(PERSIST_DIR))
 
-splits = load_and_process_pdfs("./news-summaries-pdf")
+# hybrid retrieval: BM25 over the same chunks as chroma, fused with the vector ranking
+@st.cache_resource
+def initialise_retriever(_vectorstore, version):
+    # version is part of the cache key, so the BM25 index is rebuilt when the document index changes
+    bm25 = BM25Index.from_vectorstore(_vectorstore)
+    reranker = CrossEncoder(RERANKER_MODEL) if RERANKER_MODEL else None
+    return HybridRetriever(_vectorstore, bm25, k_vector=10, k_bm25=10, top_k=4, reranker=reranker,
+                           max_context_tokens=MAX_CONTEXT_TOKENS)
 
-vectorstore = initialise_vectorstore(splits)
+retriever = initialise_retriever(vectorstore, index_version(PERSIST_DIR))
 
 # prompt template
-llm = Ollama(
-model="llama3:8b",
-callback_manager=CallbackManager(
-            [StreamingStdOutCallbackHandler()]
-),
-stop=["<|eot_id|>"],
-)
-
 prompt_template = ChatPromptTemplate(
     input_variables=['context', 'question'],
     messages=[
@@ -69,12 +180,14 @@ prompt_template = ChatPromptTemplate(
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
-rag_chain = (
-    {"context": vectorstore.as_retriever() | format_docs, "question": RunnablePassthrough()}
-    | prompt_template
-    | llm
-    | StrOutputParser()
-)
+# serving layer shared by all sessions of this process: retrieval runs concurrently, answers are
+# streamed from ollama over pooled connections and at most MAX_CONCURRENT_GENERATIONS run at once
+@st.cache_resource
+def initialise_server(_retriever, version):
+    return RAGServer(_retriever.retrieve, prompt_template, format_docs, model="llama3:8b", base_url=OLLAMA_URL,
+                     stop=["<|eot_id|>"], max_concurrent_generations=MAX_CONCURRENT_GENERATIONS)
+
+server = initialise_server(retriever, index_version(PERSIST_DIR))
 
 # streamlit app
 st.title("Generative AI for Agent-based Simulation Modelling")
@@ -96,10 +209,22 @@ if prompt := st.chat_input("How can I help?"):
     st.session_state.messages.append({"role": "user", "content": prompt})
 
     try:
-        response = rag_chain.invoke(prompt)
-        st.write(response)
-
-        # add assistant response to chat history
-        st.session_state.messages.append({"role": "assistant", "content": response})    
+        if RETRIEVAL_ONLY:
+            start = time.perf_counter()
+            docs = retriever.retrieve(prompt)
+            st.caption(f"Retrieved {len(docs)} chunks in {(time.perf_counter() - start) * 1000:.1f} ms")
+            for doc in docs:
+                st.markdown(f"**{doc.metadata.get('source')}** (page {doc.metadata.get('page')})\n\n{doc.page_content}")
+        else:
+            response = answer_cache.get(prompt)
+            if response is None:
+                # tokens are shown as they are generated, the full answer is returned at the end
+                response = st.write_stream(server.stream(prompt))
+                answer_cache.put(prompt, response)
+            else:
+                st.write(response)
+
+            # add assistant response to chat history
+            st.session_state.messages.append({"role": "assistant", "content": response})
     except Exception as e:
         st.error(f"The following error occured: {e}")
\ No newline at end of file
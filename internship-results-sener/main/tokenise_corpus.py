@@ -0,0 +1,186 @@
+"""
+Streaming tokenisation of large training corpora into uint16 shard files.
+
+Text files are read in bounded chunks and JSON fine-tune datasets record by record,
+the chunks are tokenised in batches with tiktoken's multi-threaded batch encoder, and
+the ids are written to fixed-size shards plus an index.json that mygpt.create_dataloader
+can read through its token_path argument.
+
+Usage example:
+python tokenise_corpus.py finetune_dataset.json synthetic-dataset-json --out-dir tokens
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import tiktoken
+
+# headings used by the Alpaca-style template in Modelfile_template
+RECORD_HEADINGS = {
+    "instruction": "### Instruction:",
+    "input": "### Input:",
+    "output": "### Response:",
+}
+
+
+def expand_paths(paths):
+    # directories are expanded (non-recursively) to the .txt/.json files they contain
+    for path in paths:
+        if os.path.isdir(path):
+            for file in sorted(os.listdir(path)):
+                if file.endswith((".txt", ".json")):
+                    yield os.path.join(path, file)
+        else:
+            yield path
+
+
+def iter_json_records(path):
+    with open(path, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+
+    if isinstance(data, list):
+        # records orientation: [{"instruction": ..., "output": ...}, ...]
+        yield from data
+    else:
+        # pandas column orientation, as in the *_processed.json files: {"field": {"0": ..., "1": ...}}
+        fields = list(data.keys())
+        for row in data[fields[0]].keys():
+            yield {field: data[field].get(row) for field in fields}
+
+
+def format_record(record):
+    sections = []
+    for key, value in record.items():
+        if value is None or value == "":
+            continue
+        heading = RECORD_HEADINGS.get(key, f"### {key}:")
+        sections.append(f"{heading}\n{str(value).strip()}")
+    return "\n\n".join(sections)
+
+
+def iter_text_chunks(path, chunk_chars):
+    # cut chunks at the last whitespace so that no word is split between two encode calls
+    carry = ""
+    with open(path, "r", encoding="utf-8") as fp:
+        while block := fp.read(chunk_chars):
+            block = carry + block
+            cut = max(block.rfind(" "), block.rfind("\n"))
+            if cut <= 0:
+                carry = block
+                continue
+            carry = block[cut:]
+            yield block[:cut]
+    if carry:
+        yield carry
+
+
+def iter_documents(paths, chunk_chars):
+    # yields (text, is_end); an <|endoftext|> token is appended after the last piece of a document
+    for path in expand_paths(paths):
+        if path.endswith(".json"):
+            for record in iter_json_records(path):
+                yield format_record(record), True
+        else:
+            pieces = iter_text_chunks(path, chunk_chars)
+            previous = next(pieces, None)
+            for piece in pieces:
+                yield previous, False
+                previous = piece
+            if previous is not None:
+                yield previous, True
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ShardWriter:
+    # buffers token ids and writes them out as shard_XXXXX.bin files of shard_tokens ids each
+    def __init__(self, out_dir, shard_tokens) -> None:
+        self.out_dir = out_dir
+        self.shard_tokens = shard_tokens
+        self.buffer = []
+        self.buffered = 0
+        self.shards = []
+        os.makedirs(out_dir, exist_ok=True)
+
+    def add(self, token_ids):
+        self.buffer.append(token_ids)
+        self.buffered += token_ids.size
+        while self.buffered >= self.shard_tokens:
+            tokens = np.concatenate(self.buffer)
+            self._write(tokens[:self.shard_tokens])
+            rest = tokens[self.shard_tokens:]
+            self.buffer = [rest]
+            self.buffered = rest.size
+
+    def close(self):
+        if self.buffered:
+            self._write(np.concatenate(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def _write(self, tokens):
+        file = f"shard_{len(self.shards):05d}.bin"
+        tmp_path = os.path.join(self.out_dir, file + ".tmp")
+        tokens.astype(np.uint16).tofile(tmp_path)
+        os.replace(tmp_path, os.path.join(self.out_dir, file))
+        self.shards.append({"file": file, "num_tokens": int(tokens.size)})
+
+
+def tokenise_corpus(paths, out_dir, shard_tokens=2**24, batch_size=256, chunk_chars=2**20,
+        num_threads=None):
+    tokenizer = tiktoken.get_encoding("gpt2")
+    num_threads = num_threads or os.cpu_count()
+    writer = ShardWriter(out_dir, shard_tokens)
+    sources = list(expand_paths(paths))
+
+    for batch in iter_batches(iter_documents(sources, chunk_chars), batch_size):
+        # tiktoken releases the GIL, so the batch is encoded on num_threads cores
+        encoded = tokenizer.encode_ordinary_batch([text for text, _ in batch], num_threads=num_threads)
+        for (_, is_end), token_ids in zip(batch, encoded):
+            if is_end:
+                token_ids.append(tokenizer.eot_token)
+            writer.add(np.asarray(token_ids, dtype=np.uint16))
+    writer.close()
+
+    index = {
+        "tokenizer": "gpt2",
+        "dtype": "uint16",
+        "sources": sources,
+        "num_tokens": sum(shard["num_tokens"] for shard in writer.shards),
+        "shards": writer.shards,
+    }
+    with open(os.path.join(out_dir, "index.json"), "w", encoding="utf-8") as fp:
+        json.dump(index, fp, indent=2)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenise text/JSON corpora into uint16 shard files")
+    parser.add_argument("inputs", nargs="+", help="Text or JSON files, or directories containing them")
+    parser.add_argument("--out-dir", type=str, required=True, help="Directory that receives the shards and index.json")
+    # optional flags
+    parser.add_argument("--shard-tokens", type=int, default=2**24, help="Number of tokens per shard file")
+    parser.add_argument("--batch-size", type=int, default=256, help="Number of documents/chunks encoded per batch")
+    parser.add_argument("--chunk-chars", type=int, default=2**20, help="Number of characters read from a text file at a time")
+    parser.add_argument("--threads", type=int, help="Number of encoder threads (defaults to the number of cores)")
+    args = parser.parse_args()
+
+    index = tokenise_corpus(args.inputs, args.out_dir, args.shard_tokens, args.batch_size,
+        args.chunk_chars, args.threads)
+    print(f"wrote {index['num_tokens']} tokens from {len(index['sources'])} files "
+          f"into {len(index['shards'])} shards in {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
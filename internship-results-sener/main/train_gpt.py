@@ -0,0 +1,284 @@
+"""
+Training loop for mygpt.GPTModel on CPU.
+
+Supports bf16 autocast, gradient accumulation, activation checkpointing per TransformerBlock,
+a warmup + cosine learning rate schedule and atomic checkpoints that hold the model, optimizer,
+scheduler and dataloader position, so a pre-empted run continues from its last checkpoint.
+The loss curve is written to <out-dir>/training-loss.txt in the same layout as the files in
+fine-tune-training-losses.
+
+When launched with torchrun the run is data-parallel (DistributedDataParallel over gloo): every
+rank trains on its own shard of the dataset windows and gradients are averaged across ranks.
+
+Usage example:
+python train_gpt.py --data tokens --out-dir runs/gpt --epochs 1 --batch-size 2 --grad-accum 4 --bf16
+torchrun --nproc-per-node 8 train_gpt.py --data tokens --out-dir runs/gpt --bf16
+torchrun --nnodes 4 --nproc-per-node 8 --rdzv-backend c10d --rdzv-endpoint head-node:29500 train_gpt.py --data tokens --out-dir runs/gpt
+"""
+
+import argparse
+import contextlib
+import math
+import os
+import signal
+import time
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Sampler
+
+from mygpt import GPT_CONFIG_124M, GPTModel, create_dataset, load_gpt_model
+
+
+class ResumableSampler(Sampler):
+    # deterministic shuffle per epoch (seeded with seed + epoch) that can start part-way
+    # through an epoch, so resuming skips the batches already trained on without loading them.
+    # With several ranks every rank takes every world_size-th index of the shared order, and the
+    # tail is dropped so that all ranks run the same number of steps
+    def __init__(self, num_samples, shuffle=True, seed=0, rank=0, world_size=1) -> None:
+        self.total_samples = num_samples
+        self.num_samples = num_samples // world_size  # per rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def order(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.total_samples, generator=generator).tolist()
+        else:
+            order = list(range(self.total_samples))
+        return order[:self.num_samples * self.world_size][self.rank::self.world_size]
+
+    def __iter__(self):
+        return iter(self.order()[self.start:])
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+
+def make_lr_lambda(warmup_steps, total_steps, min_lr_ratio):
+    # linear warmup followed by cosine decay down to min_lr_ratio * lr
+    def lr_lambda(step):
+        if step < warmup_steps:
+            return (step + 1) / warmup_steps
+        progress = min(1.0, (step - warmup_steps) / max(1, total_steps - warmup_steps))
+        return min_lr_ratio + (1 - min_lr_ratio) * 0.5 * (1 + math.cos(math.pi * progress))
+    return lr_lambda
+
+
+def save_checkpoint(path, state):
+    # write to a temporary file first, so a pre-emption mid-write never leaves a broken checkpoint
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def open_loss_log(path, header, resume_step):
+    # on resume, drop the entries logged after the checkpoint that is being resumed from
+    if resume_step and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as fp:
+            lines = fp.readlines()
+        kept = [line for line in lines if not line.split("\t")[0].isdigit() or int(line.split("\t")[0]) <= resume_step]
+        log = open(path, "w", encoding="utf-8")
+        log.writelines(kept)
+    else:
+        log = open(path, "w", encoding="utf-8")
+        log.write(header)
+        log.write("Step\tTraining Loss\n")
+    log.flush()
+    return log
+
+
+def build_model(args):
+    if args.checkpoint:
+        model, cfg = load_gpt_model(args.checkpoint, drop_rate=args.drop_rate)
+    else:
+        cfg = {**GPT_CONFIG_124M, "drop_rate": args.drop_rate}
+        model = GPTModel(cfg)
+    model.activation_checkpointing = args.activation_checkpointing
+    return model, cfg
+
+
+def build_dataset(args, context_length):
+    max_length = min(args.max_length, context_length)
+    stride = args.stride or max_length
+    if os.path.isdir(args.data) or args.data.endswith(".bin"):
+        return create_dataset(None, max_length, stride, token_path=args.data)
+    with open(args.data, "r", encoding="utf-8") as fp:
+        txt = fp.read()
+    return create_dataset(txt, max_length, stride)
+
+
+def setup_distributed():
+    # torchrun sets WORLD_SIZE/RANK/LOCAL_WORLD_SIZE; a plain `python train_gpt.py` runs as one process
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size == 1:
+        return 0, 1, 1
+    dist.init_process_group(backend="gloo")
+    return dist.get_rank(), world_size, int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+
+
+def train(args):
+    rank, world_size, local_world_size = setup_distributed()
+    is_main = rank == 0
+
+    # every rank starts from the same weights; DDP also broadcasts rank 0's on wrapping
+    torch.manual_seed(args.seed)
+    # split the cores of a host between the ranks running on it instead of oversubscribing them
+    threads = args.threads or max(1, (os.cpu_count() or 1) // local_world_size)
+    torch.set_num_threads(threads)
+    os.makedirs(args.out_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.out_dir, "checkpoint.pt")
+
+    model, cfg = build_model(args)
+    dataset = build_dataset(args, cfg["context_length"])
+    sampler = ResumableSampler(len(dataset), shuffle=True, seed=args.seed, rank=rank, world_size=world_size)
+    loader = DataLoader(dataset, batch_size=args.batch_size, sampler=sampler, drop_last=True,
+        num_workers=args.num_workers)
+
+    steps_per_epoch = (sampler.num_samples // args.batch_size) // args.grad_accum
+    total_steps = steps_per_epoch * args.epochs
+    assert steps_per_epoch > 0, "dataset is too small for one optimizer step"
+
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    scheduler = torch.optim.lr_scheduler.LambdaLR(
+        optimizer, make_lr_lambda(args.warmup_steps, total_steps, args.min_lr / args.lr))
+
+    step = 0
+    if args.resume and os.path.exists(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        torch.set_rng_state(state["rng_state"])
+        step = state["step"]
+        if is_main:
+            print(f"resuming from step {step}/{total_steps}")
+
+    raw_model = model
+    if world_size > 1:
+        # the only buffers are the constant causal masks, so there is nothing to broadcast each step
+        model = DistributedDataParallel(model, broadcast_buffers=False)
+
+    header = (f"Num examples = {len(dataset):,} | Num Epochs = {args.epochs}\n"
+              f"Num processes = {world_size} | Batch size per device = {args.batch_size} | Gradient Accumulation steps = {args.grad_accum}\n"
+              f"Total batch size = {args.batch_size * args.grad_accum * world_size} | Total steps = {total_steps}\n"
+              f"Number of trainable parameters = {sum(p.numel() for p in raw_model.parameters() if p.requires_grad):,}\n")
+    log = open_loss_log(os.path.join(args.out_dir, "training-loss.txt"), header, step) if is_main else None
+
+    def checkpoint_state():
+        # the dataloader position follows from step: epoch = step // steps_per_epoch and the
+        # sampler restarts after (step % steps_per_epoch) * grad_accum batches of that epoch
+        return {
+            "model": raw_model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "scheduler": scheduler.state_dict(),
+            "rng_state": torch.get_rng_state(),
+            "step": step,
+            "cfg": cfg,
+            "args": vars(args),
+        }
+
+    # on SIGTERM (pre-emption) finish the current optimizer step, checkpoint and exit
+    stop_requested = False
+
+    def request_stop(signum, frame):
+        nonlocal stop_requested
+        stop_requested = True
+    signal.signal(signal.SIGTERM, request_stop)
+
+    model.train()
+    start_time = time.time()
+    while step < total_steps and not stop_requested:
+        epoch = step // steps_per_epoch
+        sampler.set_epoch(epoch, start=(step % steps_per_epoch) * args.grad_accum * args.batch_size)
+
+        batches = iter(loader)
+        for _ in range(step % steps_per_epoch, steps_per_epoch):
+            optimizer.zero_grad(set_to_none=True)
+            step_loss = 0.0
+            for micro_step in range(args.grad_accum):
+                input_batch, target_batch = next(batches)
+                # with DDP, gradients are only all-reduced on the last micro-batch of the step
+                sync = world_size == 1 or micro_step == args.grad_accum - 1
+                with (contextlib.nullcontext() if sync else model.no_sync()):
+                    with torch.autocast(device_type="cpu", dtype=torch.bfloat16, enabled=args.bf16):
+                        logits = model(input_batch)
+                        loss = torch.nn.functional.cross_entropy(logits.flatten(0, 1).float(), target_batch.flatten())
+                    (loss / args.grad_accum).backward()
+                step_loss += loss.item() / args.grad_accum
+
+            if args.max_grad_norm:
+                torch.nn.utils.clip_grad_norm_(model.parameters(), args.max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            step += 1
+
+            if world_size > 1:
+                # average the logged loss over ranks, and stop on every rank if any was signalled
+                stats = torch.tensor([step_loss / world_size, float(stop_requested)])
+                dist.all_reduce(stats[:1])
+                dist.all_reduce(stats[1:], op=dist.ReduceOp.MAX)
+                step_loss, stop_requested = stats[0].item(), bool(stats[1].item())
+
+            if is_main:
+                log.write(f"{step}\t{step_loss:.6f}\n")
+                log.flush()
+                print(f"[{step}/{total_steps} {time.time() - start_time:.0f}s, Epoch {epoch}/{args.epochs}] "
+                      f"loss {step_loss:.4f} lr {scheduler.get_last_lr()[0]:.2e}")
+
+            if is_main and (step % args.save_every == 0 or step == total_steps or stop_requested):
+                save_checkpoint(checkpoint_path, checkpoint_state())
+            if stop_requested:
+                print(f"stopped at step {step}, resume with --resume")
+                break
+
+    if is_main:
+        log.close()
+    if world_size > 1:
+        dist.barrier()  # keep the other ranks alive until rank 0 has written its final checkpoint
+        dist.destroy_process_group()
+    return raw_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train GPTModel on a text file or tokenised shards")
+    parser.add_argument("--data", type=str, required=True, help="Text file, uint16 token file (.bin) or shard directory from tokenise_corpus.py")
+    parser.add_argument("--out-dir", type=str, required=True, help="Directory for checkpoint.pt and training-loss.txt")
+    # optional flags
+    parser.add_argument("--checkpoint", type=str, help="GPT-2 checkpoint to start from instead of random weights")
+    parser.add_argument("--resume", action="store_true", help="Continue from <out-dir>/checkpoint.pt if it exists")
+    parser.add_argument("--epochs", type=int, default=1, help="Number of epochs")
+    parser.add_argument("--batch-size", type=int, default=2, help="Batch size per micro-batch")
+    parser.add_argument("--grad-accum", type=int, default=4, help="Number of micro-batches per optimizer step")
+    parser.add_argument("--max-length", type=int, default=256, help="Tokens per training window")
+    parser.add_argument("--stride", type=int, help="Stride between windows (defaults to --max-length)")
+    parser.add_argument("--lr", type=float, default=4e-4, help="Peak learning rate")
+    parser.add_argument("--min-lr", type=float, default=4e-5, help="Learning rate at the end of the cosine decay")
+    parser.add_argument("--warmup-steps", type=int, default=10, help="Number of linear warmup steps")
+    parser.add_argument("--weight-decay", type=float, default=0.1, help="AdamW weight decay")
+    parser.add_argument("--max-grad-norm", type=float, default=1.0, help="Gradient clipping norm (0 disables)")
+    parser.add_argument("--drop-rate", type=float, default=0.1, help="Dropout rate")
+    parser.add_argument("--bf16", action="store_true", help="Run forward passes under bf16 autocast")
+    parser.add_argument("--activation-checkpointing", action="store_true", help="Recompute TransformerBlock activations in the backward pass to save memory")
+    parser.add_argument("--save-every", type=int, default=50, help="Checkpoint every N optimizer steps")
+    parser.add_argument("--num-workers", type=int, default=0, help="DataLoader worker processes")
+    parser.add_argument("--threads", type=int, help="Intra-op threads per process (defaults to the host's cores divided by the processes on it)")
+    parser.add_argument("--seed", type=int, default=123, help="Seed for initialisation and data order")
+    args = parser.parse_args()
+
+    train(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Non-interactive batch runner for EABSS studies and model sweeps.
+
+Reads a JSON matrix of topics, models and sampling parameters, runs every combination as an
+independent conversation through eabss_engine, and runs them concurrently with a limit per
+provider (e.g. one at a time on a local ollama, several against OpenAI). Each run writes its
+prompt -> response JSON in the same layout as the bots, and summary.json lists every run with
+its settings, token totals, wall time and error (if any). Turns are journaled as they finish,
+so re-running an interrupted sweep with the same out_dir continues every run where it stopped.
+
+Matrix example (topics take the INJECT_* values without braces; TOPIC can be read from a file):
+{
+  "script": "streamlining_eabss_3_advanced_model_script.json",
+  "out_dir": "batch_runs",
+  "concurrency": {"ollama": 1, "openai": 4, "gemini": 2},
+  "rate_limits": {"openai": {"rpm": 500, "tpm": 200000}, "gemini": {"rpm": 5}},
+  "topics": {
+    "conway": {"topic_file": "test_prompts/conway.txt", "RESEARCHDESIGN": "Exploratory",
+               "DOMAIN": "Complex Systems", "SPECIALISATION": "Cellular Automata", "DOMAIN_RELATED_ROLE": "Mathematician"}
+  },
+  "models": [{"provider": "ollama", "model": "gemma3:12b-it-qat"}, {"provider": "openai", "model": "o4-mini-2025-04-16"}],
+  "params": [{"temperature": 0.6, "top_k": 40, "top_p": 0.8}, {"temperature": 0.9}],
+  "repeats": 1,
+  "context_budget": 8000,
+  "stream": true,
+  "record": false,
+  "metrics": true,
+  "prometheus_port": 9464,
+  "results_db": "results.sqlite"
+}
+
+Usage example:
+python eabss_batch.py sweep.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import time
+
+from dotenv import load_dotenv
+
+from eabss_cassette import RecordingProvider
+from eabss_engine import PROVIDERS, load_script, make_provider, run_conversation, write_results
+from eabss_history import HistoryManager
+from eabss_journal import Journal
+from eabss_ratelimit import configure_limits
+from eabss_results import ResultsStore
+from eabss_telemetry import MetricsExporter
+
+# {INJECT_CHATBOT} / {INJECT_CHATBOT_COMPANY} per provider, as set by the single-run bots
+CHATBOT_INJECTABLES = {
+    "openai": {"CHATBOT": "ChatGPT", "CHATBOT_COMPANY": "OpenAI"},
+    "gemini": {"CHATBOT": "Gemini 2.5 Pro", "CHATBOT_COMPANY": "Google"},
+}
+DEFAULT_CONCURRENCY = 1
+
+
+def slug(text):
+    return re.sub(r"[^A-Za-z0-9.]+", "_", str(text)).strip("_")
+
+
+def params_slug(params):
+    return "_".join(f"{slug(key)}{slug(value)}" for key, value in sorted(params.items())) or "default"
+
+
+def topic_injectables(topic, base_dir):
+    values = dict(topic)
+    if "topic_file" in values:
+        with open(os.path.join(base_dir, values.pop("topic_file")), encoding="utf-8") as fp:
+            values["TOPIC"] = fp.read().strip()
+    return values
+
+
+def expand_matrix(matrix, base_dir):
+    # one run per topic x model x params x repeat
+    runs = []
+    combinations = itertools.product(
+        matrix["topics"].items(), matrix["models"], matrix.get("params") or [{}], range(matrix.get("repeats", 1))
+    )
+    for (topic_name, topic), model, params, repeat in combinations:
+        values = dict(CHATBOT_INJECTABLES.get(model["provider"], {}))
+        values.update(model.get("injectables", {}))
+        values.update(topic_injectables(topic, base_dir))
+        name = f"{slug(model['model'])}_{slug(topic_name)}_{params_slug(params)}_r{repeat}"
+        runs.append({
+            "name": name,
+            "topic": topic_name,
+            "provider": model["provider"],
+            "model": model["model"],
+            "params": params,
+            "repeat": repeat,
+            "injectables": {f"{{INJECT_{key}}}": value for key, value in values.items()},
+        })
+    return runs
+
+
+async def run_one(run, script, providers, limits, out_dir, context_budget=None, stream=False, record_cassette=False,
+                  telemetry=None, store=None):
+    # every run journals its turns to <name>.journal.jsonl; running the batch again over the same
+    # out_dir resumes each run from its journal, and finished runs are replayed without requests
+    async with limits[run["provider"]]:
+        print(f"started  {run['name']}")
+        start = time.perf_counter()
+        record = {key: run[key] for key in ("name", "topic", "provider", "model", "params", "repeat")}
+        own_provider = None
+        try:
+            journal = Journal(os.path.join(out_dir, f"{run['name']}.journal.jsonl"), header=run)
+            provider = providers.get((run["provider"], run["model"]))
+            if provider is None:
+                # e.g. replay: every run starts from the beginning of its own cassette
+                provider = own_provider = make_provider(run["provider"], run["model"])
+            if record_cassette:
+                # <name>.cassette.jsonl can be replayed offline with eabss_stub_server.py or the "replay" provider
+                provider = RecordingProvider(provider, os.path.join(out_dir, f"{run['name']}.cassette.jsonl"))
+            result = await run_conversation(
+                provider, script, run["injectables"], run["params"], echo=False,
+                journal=journal, history=HistoryManager(context_budget) if context_budget else None, stream=stream,
+                telemetry=telemetry, run_id=run["name"],
+            )
+            record["file"] = write_results(result, os.path.join(out_dir, f"{run['name']}.json"))
+            if store is not None:
+                store.add_result(run["name"], result, source=record["file"], provider=run["provider"], model=run["model"],
+                                 topic=run["topic"], params=run["params"])
+            record.update(status="ok", total_in=result.total_in, total_out=result.total_out, turns=len(result.turns))
+        except Exception as e:
+            # one failed conversation must not stop the rest of the sweep
+            record.update(status="error", error=f"{type(e).__name__}: {e}")
+        finally:
+            if own_provider is not None:
+                await own_provider.aclose()
+        record["wall_time"] = time.perf_counter() - start
+        print(f"finished {run['name']} ({record['status']}, {record['wall_time']:.1f} s)")
+        return record
+
+
+async def run_batch(matrix, base_dir="."):
+    script = load_script(os.path.join(base_dir, matrix["script"]))
+    out_dir = os.path.join(base_dir, matrix.get("out_dir", "batch_runs"))
+    os.makedirs(out_dir, exist_ok=True)
+    runs = expand_matrix(matrix, base_dir)
+    if "rate_limits" in matrix:
+        # requests/tokens per minute, shared by all runs on the same provider and model (see eabss_ratelimit)
+        configure_limits(matrix["rate_limits"])
+
+    concurrency = matrix.get("concurrency", {})
+    limits = {name: asyncio.Semaphore(concurrency.get(name, DEFAULT_CONCURRENCY)) for name in {run["provider"] for run in runs}}
+    # one adapter (and connection pool) per provider and model, shared by all of its runs; adapters
+    # with per-conversation state are made by each run instead
+    providers = {key: make_provider(*key) for key in {(run["provider"], run["model"]) for run in runs}
+                 if getattr(PROVIDERS.get(key[0]), "shared", True)}
+
+    # per-turn metrics of all runs go to one file (and optionally a Prometheus endpoint)
+    telemetry = None
+    if matrix.get("metrics") or matrix.get("prometheus_port"):
+        metrics_path = os.path.join(out_dir, "metrics.jsonl") if matrix.get("metrics") else None
+        telemetry = MetricsExporter(metrics_path, matrix.get("prometheus_port"))
+    # finished runs are also added to an indexed results database (see eabss_results)
+    store = ResultsStore(os.path.join(out_dir, matrix["results_db"])) if matrix.get("results_db") else None
+
+    started = time.strftime("%Y%m%d-%H%M%S")
+    start = time.perf_counter()
+    try:
+        records = await asyncio.gather(*(
+            run_one(run, script, providers, limits, out_dir, matrix.get("context_budget"),
+                    matrix.get("stream", False), matrix.get("record", False), telemetry, store)
+            for run in runs
+        ))
+    finally:
+        for provider in providers.values():
+            await provider.aclose()
+        if telemetry is not None:
+            telemetry.close()
+        if store is not None:
+            store.close()
+
+    summary = {
+        "started": started,
+        "wall_time": time.perf_counter() - start,
+        "script": matrix["script"],
+        "runs": records,
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as fp:
+        json.dump(summary, fp, ensure_ascii=False, indent=2)
+    return summary
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run a matrix of EABSS conversations concurrently")
+    parser.add_argument("matrix", type=str, help="JSON file with script, topics, models, params and concurrency")
+    parser.add_argument("--out-dir", type=str, help="Override the matrix's out_dir")
+    args = parser.parse_args()
+
+    with open(args.matrix, encoding="utf-8") as fp:
+        matrix = json.load(fp)
+    if args.out_dir:
+        matrix["out_dir"] = os.path.abspath(args.out_dir)
+    # paths in the matrix are relative to the matrix file
+    summary = asyncio.run(run_batch(matrix, os.path.dirname(os.path.abspath(args.matrix))))
+    failed = sum(record["status"] != "ok" for record in summary["runs"])
+    print(f"{len(summary['runs'])} runs in {summary['wall_time']:.1f} s, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Record/replay cassettes of provider requests for offline EABSS benchmarking.
+
+A cassette is a JSON-lines file with one entry per request: the prompt (the last user message),
+the response, the token counts and the measured latency and time to first token. Cassettes
+are recorded from real runs with RecordingProvider, or imported from the prompt -> response
+dumps the bots already wrote (test_dump, final_*), which have no latencies.
+
+Replay looks an entry up by its exact prompt and otherwise takes the next unused entry, so a
+cassette recorded for one topic still drives a run with other injectables. ReplayProvider
+replays in-process (provider "replay", with the cassette path as the model name), and
+eabss_stub_server.py serves cassettes over the Ollama and OpenAI chat APIs.
+
+Usage example:
+python eabss_cassette.py import test_dump/mistral-nemo_latest_test_20250717-111648.json cassettes/nemo.jsonl
+python eabss_batch.py sweep.json   # with {"provider": "replay", "model": "cassettes/nemo.jsonl"}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+from eabss_engine import PROVIDERS, Provider, TurnResult
+
+
+def last_prompt(messages):
+    for message in reversed(messages):
+        if message["role"] == "user":
+            return message["content"]
+    return ""
+
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class Cassette:
+    def __init__(self, path=None, entries=None) -> None:
+        self.path = path
+        self.entries = entries if entries is not None else []
+        if path and entries is None and os.path.exists(path):
+            with open(path, encoding="utf-8") as fp:
+                self.entries = [json.loads(line) for line in fp if line.strip()]
+        self.by_prompt = {}
+        for position, entry in enumerate(self.entries):
+            self.by_prompt.setdefault(entry["prompt"], []).append(position)
+        self.used = set()
+        self.lock = threading.Lock()  # the stub server looks entries up from several threads
+
+    def record(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def lookup(self, messages):
+        prompt = last_prompt(messages)
+        with self.lock:
+            if not self.entries:
+                raise LookupError(f"cassette {self.path} is empty")
+            for position in self.by_prompt.get(prompt, []):
+                if position not in self.used:
+                    break
+            else:
+                # replay the next unused entry; once all are used, start over
+                unused = [p for p in range(len(self.entries)) if p not in self.used]
+                if not unused:
+                    self.used.clear()
+                    unused = list(range(len(self.entries)))
+                position = unused[0]
+            self.used.add(position)
+            return self.entries[position]
+
+
+class RecordingProvider(Provider):
+    # wraps a provider and appends every request it answers to a cassette
+    def __init__(self, inner, path) -> None:
+        self.inner = inner
+        self.name = inner.name
+        self.model = inner.model
+        self.limiter = inner.limiter
+        self.cassette = Cassette(path, entries=[])
+
+    def record(self, messages, turn, latency):
+        self.cassette.record({
+            "provider": self.inner.name,
+            "model": self.inner.model,
+            "prompt": last_prompt(messages),
+            "response": turn.content,
+            "input_tokens": turn.input_tokens,
+            "output_tokens": turn.output_tokens,
+            "latency": latency,
+            "ttft": turn.ttft,
+            "recorded": time.strftime("%Y%m%d-%H%M%S"),
+        })
+
+    async def chat(self, messages, params):
+        start = time.perf_counter()
+        turn = await self.inner.chat(messages, params)
+        self.record(messages, turn, time.perf_counter() - start)
+        return turn
+
+    async def chat_stream(self, messages, params, on_token):
+        start = time.perf_counter()
+        first = None
+
+        def forward(piece):
+            nonlocal first
+            first = first or time.perf_counter()
+            on_token(piece)
+
+        turn = await self.inner.chat_stream(messages, params, forward)
+        turn.ttft = None if first is None else first - start
+        self.record(messages, turn, time.perf_counter() - start)
+        return turn
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def replay_timing(entry, latency_scale=1.0, ttft=None, tokens_per_sec=None):
+    # returns (seconds before the first token, seconds per output token); recorded timings are
+    # used where the cassette has them and the given defaults otherwise
+    output_tokens = entry.get("output_tokens") or approx_tokens(entry["response"])
+    first = ttft if ttft is not None else (entry.get("ttft") or 0.0) * latency_scale
+    if tokens_per_sec:
+        per_token = 1.0 / tokens_per_sec
+    elif entry.get("latency"):
+        per_token = max(0.0, entry["latency"] * latency_scale - first) / output_tokens
+    else:
+        per_token = 0.0
+    return first, per_token
+
+
+class ReplayProvider(Provider):
+    name = "replay"
+    shared = False  # the cassette's position belongs to one conversation
+
+    def __init__(self, model, latency_scale=1.0, ttft=None, tokens_per_sec=None, **kwargs) -> None:
+        self.model = model  # the cassette path
+        self.cassette = Cassette(model)
+        self.latency_scale = latency_scale
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+
+    def turn(self, entry, messages):
+        input_tokens = entry.get("input_tokens") or sum(approx_tokens(m["content"]) for m in messages)
+        output_tokens = entry.get("output_tokens") or approx_tokens(entry["response"])
+        return TurnResult(entry["response"], input_tokens, output_tokens, {"replayed": True})
+
+    async def chat(self, messages, params):
+        entry = self.cassette.lookup(messages)
+        first, per_token = replay_timing(entry, self.latency_scale, self.ttft, self.tokens_per_sec)
+        turn = self.turn(entry, messages)
+        await asyncio.sleep(first + per_token * turn.output_tokens)
+        return turn
+
+    async def chat_stream(self, messages, params, on_token):
+        entry = self.cassette.lookup(messages)
+        first, per_token = replay_timing(entry, self.latency_scale, self.ttft, self.tokens_per_sec)
+        turn = self.turn(entry, messages)
+        await asyncio.sleep(first)
+        words = entry["response"].split(" ")
+        delay = per_token * turn.output_tokens / len(words)
+        for i, word in enumerate(words):
+            on_token(word if i == len(words) - 1 else word + " ")
+            await asyncio.sleep(delay)
+        return turn
+
+    async def aclose(self):
+        pass
+
+
+PROVIDERS[ReplayProvider.name] = ReplayProvider
+
+
+def import_dump(dump_path, cassette_path):
+    # the bots' result JSON maps the injected prompt to the response, in conversation order
+    with open(dump_path, encoding="utf-8") as fp:
+        dump = json.load(fp)
+    model = os.path.basename(dump_path).rsplit("_test_", 1)[0].rsplit("_run_", 1)[0]
+    open(cassette_path, "w", encoding="utf-8").close()
+    cassette = Cassette(cassette_path, entries=[])
+    for prompt, response in dump.items():
+        cassette.record({
+            "provider": None,
+            "model": model,
+            "prompt": prompt,
+            "response": response,
+            "input_tokens": None,
+            "output_tokens": approx_tokens(response),
+            "latency": None,
+            "ttft": None,
+            "recorded": None,
+        })
+    return len(cassette.entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage EABSS record/replay cassettes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    importer = subparsers.add_parser("import", help="Convert a bot result JSON (prompt -> response) into a cassette")
+    importer.add_argument("dump", type=str, help="Result JSON written by one of the bots")
+    importer.add_argument("cassette", type=str, help="Cassette file to write (.jsonl)")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        count = import_dump(args.dump, args.cassette)
+        print(f"wrote {count} entries to {args.cassette}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+"""
+Shared async engine for the EABSS automation bots.
+
+The three bots (eabss_automation_bot.py for Ollama, chatgpt_eabss_automation_bot.py for OpenAI
+and gemini_eabss_automation_bot.py for Gemini) only differ in how a chat request is sent, so
+that part lives in provider adapters here and all of them share one run_conversation. Every
+adapter talks HTTP through its own httpx.AsyncClient, which keeps connections open between
+turns, and nothing blocks the event loop, so many conversations can run in one process.
+
+Usage example:
+provider = make_provider("ollama", "gemma3:12b-it-qat")
+script = load_script("streamlining_eabss_3_advanced_model_script.json")
+result = asyncio.run(run_conversation(provider, script, injectables, {"temperature": 0.6}))
+"""
+
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+
+import httpx
+
+from eabss_ratelimit import estimate_tokens, get_limiter
+
+SYSTEM_PROMPT = "You are an assistant that must assist the user"
+
+
+@dataclass
+class TurnResult:
+    content: str
+    input_tokens: int = 0   # prompt tokens of this request, as reported by the provider
+    output_tokens: int = 0  # completion tokens of this request
+    raw: dict = field(default_factory=dict)  # provider response body, minus the message text
+    ttft: float = None      # seconds to the first streamed token, None when not streamed
+
+
+@dataclass
+class ConversationResult:
+    prompt_output_map: dict = field(default_factory=dict)    # injected prompt -> response (what the bots write)
+    prompt_name_out_map: dict = field(default_factory=dict)  # prompt name -> response
+    turns: list = field(default_factory=list)                # one dict per turn, in order
+    total_in: int = 0
+    total_out: int = 0
+
+
+class Provider:
+    # an adapter sends the whole conversation (a list of {"role", "content"} messages) and
+    # returns the reply of the model; params holds the sampling settings set for the run
+    name = "base"
+    limiter = None  # eabss_ratelimit.RateLimiter shared by every conversation on this provider and model
+    shared = True   # False for adapters that keep per-conversation state, which need one instance per run
+
+    def __init__(self, model, base_url, headers=None, timeout=600.0, max_connections=8) -> None:
+        self.model = model
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+
+    async def chat(self, messages, params):
+        raise NotImplementedError
+
+    async def chat_stream(self, messages, params, on_token):
+        # like chat(), but calls on_token(text) for every piece as it arrives; adapters without
+        # a streaming API deliver the whole reply as one piece
+        turn = await self.chat(messages, params)
+        on_token(turn.content)
+        return turn
+
+    async def request(self, messages, params, on_token=None, on_attempt=None):
+        # chat() (or chat_stream() when on_token is given) behind the rate limiter, with retries
+        # on 429s, server errors and timeouts. on_attempt() is called before every attempt, so a
+        # streamed reply that failed partway can drop what it already received before the retry
+        async def send():
+            if on_attempt is not None:
+                on_attempt()
+            if on_token is None:
+                return await self.chat(messages, params)
+            return await self.chat_stream(messages, params, on_token)
+        if self.limiter is None:
+            return await send()
+        return await self.limiter.call(send, estimate_tokens(messages))
+
+    async def post(self, url, payload):
+        response = await self.client.post(url, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream_lines(self, url, payload):
+        # yields the non-empty lines of a streamed response (ollama's JSON lines or SSE)
+        async with self.client.stream("POST", url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield line
+
+    async def stream_events(self, url, payload):
+        # yields the JSON data of server-sent events, as used by OpenAI and Gemini
+        async for line in self.stream_lines(url, payload):
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            yield json.loads(data)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def parse_ollama_host(host):
+    """
+    OLLAMA_HOST as the ollama client reads it: "host", "host:port" or a full url; the scheme
+    defaults to http and the port to 11434 (80/443 when only the scheme is given). IPv6
+    addresses may be given bare or in brackets.
+
+    >>> parse_ollama_host(None)
+    'http://127.0.0.1:11434'
+    >>> parse_ollama_host("0.0.0.0:11434")
+    'http://0.0.0.0:11434'
+    >>> parse_ollama_host("https://example.com/ollama/")
+    'https://example.com:443/ollama'
+    >>> parse_ollama_host("::1")
+    'http://[::1]:11434'
+    >>> parse_ollama_host("[::1]:8080")
+    'http://[::1]:8080'
+    """
+    host, port = host or "", 11434
+    scheme, _, hostport = host.partition("://")
+    if not hostport:
+        scheme, hostport = "http", host
+    elif scheme == "http":
+        port = 80
+    elif scheme == "https":
+        port = 443
+    address, slash, path = hostport.partition("/")
+    if address.count(":") > 1 and not address.startswith("["):
+        # a bare ipv6 address; urlsplit would read its last group as the port
+        hostport = f"[{address}]{slash}{path}"
+    split = urllib.parse.urlsplit(f"{scheme}://{hostport}")
+    hostname = split.hostname or "127.0.0.1"
+    if ":" in hostname:
+        hostname = f"[{hostname}]"  # ipv6
+    url = f"{scheme}://{hostname}:{split.port or port}"
+    path = split.path.strip("/")
+    return f"{url}/{path}" if path else url
+
+
+class OllamaProvider(Provider):
+    name = "ollama"
+    # sampling settings that ollama takes in "options"
+    OPTIONS = ("temperature", "top_k", "top_p", "repeat_penalty", "num_ctx", "seed")
+
+    def __init__(self, model, base_url=None, **kwargs) -> None:
+        super().__init__(model, base_url or parse_ollama_host(os.getenv("OLLAMA_HOST")), **kwargs)
+
+    def payload(self, messages, params, stream):
+        payload = {"model": self.model, "messages": messages, "stream": stream}
+        options = {key: value for key, value in params.items() if key in self.OPTIONS and value is not None}
+        if options:
+            payload["options"] = options
+        return payload
+
+    async def chat(self, messages, params):
+        body = await self.post("/api/chat", self.payload(messages, params, stream=False))
+        content = body.pop("message")["content"]
+        # if the context window becomes full, ollama trims the oldest tokens so prompt_eval_count may shrink
+        return TurnResult(content, body.get("prompt_eval_count", 0), body.get("eval_count", 0), body)
+
+    async def chat_stream(self, messages, params, on_token):
+        pieces = []
+        async for line in self.stream_lines("/api/chat", self.payload(messages, params, stream=True)):
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            piece = chunk.pop("message", {}).get("content", "")
+            if piece:
+                pieces.append(piece)
+                on_token(piece)
+            if chunk.get("done"):
+                # the last chunk carries the token counts and server-side durations
+                return TurnResult("".join(pieces), chunk.get("prompt_eval_count", 0), chunk.get("eval_count", 0), chunk)
+        raise RuntimeError("ollama closed the stream before it was done")
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+    OPTIONS = ("temperature", "top_p", "seed")
+
+    def __init__(self, model, base_url=None, api_key=None, **kwargs) -> None:
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise SystemExit(
+                "OPENAI_API_KEY is missing.\n"
+                "Create a .env file that contains a line like:\n"
+                "OPENAI_API_KEY=sk-..."
+            )
+        super().__init__(model, base_url or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+                         headers={"Authorization": f"Bearer {api_key}"}, **kwargs)
+
+    def payload(self, messages, params):
+        payload = {"model": self.model, "messages": messages}
+        payload.update({key: value for key, value in params.items() if key in self.OPTIONS and value is not None})
+        return payload
+
+    async def chat(self, messages, params):
+        body = await self.post("/chat/completions", self.payload(messages, params))
+        content = body["choices"][0]["message"]["content"]
+        usage = body.get("usage") or {}
+        return TurnResult(content, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), body)
+
+    async def chat_stream(self, messages, params, on_token):
+        payload = self.payload(messages, params)
+        payload.update(stream=True, stream_options={"include_usage": True})
+        pieces = []
+        usage = {}
+        async for chunk in self.stream_events("/chat/completions", payload):
+            for choice in chunk.get("choices") or []:
+                piece = (choice.get("delta") or {}).get("content")
+                if piece:
+                    pieces.append(piece)
+                    on_token(piece)
+            # usage arrives in a final chunk without choices
+            usage = chunk.get("usage") or usage
+        return TurnResult("".join(pieces), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), {"usage": usage})
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    OPTIONS = {"temperature": "temperature", "top_p": "topP", "top_k": "topK", "seed": "seed"}
+
+    def __init__(self, model, base_url=None, api_key=None, **kwargs) -> None:
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise SystemExit(
+                "GEMINI_API_KEY is missing.\n"
+                "Create a .env file that contains a line like:\n"
+                "GEMINI_API_KEY=AIza..."
+            )
+        super().__init__(model, base_url or "https://generativelanguage.googleapis.com/v1beta",
+                         headers={"x-goog-api-key": api_key}, **kwargs)
+
+    def payload(self, messages, params):
+        # gemini takes the system prompt separately and calls the assistant role "model"
+        system = [{"text": m["content"]} for m in messages if m["role"] == "system"]
+        contents = [
+            {"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+            for m in messages if m["role"] != "system"
+        ]
+        payload = {"contents": contents}
+        if system:
+            payload["systemInstruction"] = {"parts": system}
+        config = {name: params[key] for key, name in self.OPTIONS.items() if params.get(key) is not None}
+        if config:
+            payload["generationConfig"] = config
+        return payload
+
+    async def chat(self, messages, params):
+        body = await self.post(f"/models/{self.model}:generateContent", self.payload(messages, params))
+        parts = body["candidates"][0]["content"].get("parts", [])
+        content = "".join(part.get("text", "") for part in parts).strip()
+        usage = body.get("usageMetadata") or {}
+        return TurnResult(content, usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0), body)
+
+    async def chat_stream(self, messages, params, on_token):
+        pieces = []
+        usage = {}
+        url = f"/models/{self.model}:streamGenerateContent?alt=sse"
+        async for chunk in self.stream_events(url, self.payload(messages, params)):
+            for candidate in chunk.get("candidates") or []:
+                for part in (candidate.get("content") or {}).get("parts", []):
+                    if part.get("text"):
+                        pieces.append(part["text"])
+                        on_token(part["text"])
+            usage = chunk.get("usageMetadata") or usage
+        content = "".join(pieces).strip()
+        return TurnResult(content, usage.get("promptTokenCount", 0), usage.get("candidatesTokenCount", 0), {"usageMetadata": usage})
+
+
+class StubProvider(Provider):
+    # answers locally without any server: useful for dry runs of a script and for measuring
+    # the engine's own overhead; latency is the simulated seconds per reply
+    name = "stub"
+
+    def __init__(self, model="stub", latency=0.0, **kwargs) -> None:
+        self.model = model
+        self.latency = latency
+        self.client = None
+
+    async def chat(self, messages, params):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        content = f"[{self.model}] reply to: {prompt[:200]}"
+        input_tokens = sum(len(m["content"].split()) for m in messages)
+        return TurnResult(content, input_tokens, len(content.split()), {})
+
+    async def chat_stream(self, messages, params, on_token):
+        turn = await self.chat(messages, params)
+        for word in turn.content.split(" "):
+            await asyncio.sleep(0)  # hand control back like a real stream would
+            on_token(word + " ")
+        return turn
+
+    async def aclose(self):
+        pass
+
+
+PROVIDERS = {
+    OllamaProvider.name: OllamaProvider,
+    OpenAIProvider.name: OpenAIProvider,
+    GeminiProvider.name: GeminiProvider,
+    StubProvider.name: StubProvider,
+}
+
+
+def make_provider(name, model, **kwargs):
+    if name not in PROVIDERS:
+        raise ValueError(f"unknown provider {name!r}, expected one of {sorted(PROVIDERS)}")
+    provider = PROVIDERS[name](model, **kwargs)
+    provider.limiter = get_limiter(name, model)
+    return provider
+
+
+def load_script(path):
+    # the script JSON is a list of {prompt_name: prompt_text}; returns [(prompt_name, prompt_text)]
+    with open(path, encoding="utf-8") as fp:
+        lines = json.load(fp)
+    return [(prompt_name, prompt) for line in lines for prompt_name, prompt in line.items()]
+
+
+def ask_user_inputs(**fixed):
+    # stores user's responses that are fundamentally necessary e.g. topic of the current EABSS study,
+    # these responses (strings) are injected into the prompt; fixed holds bot-specific injectables
+    injects = {f"{{INJECT_{key}}}": value for key, value in fixed.items()}
+    injects.update({
+        "{INJECT_TOPIC}": input("Please enter the topic (a summary upto 100 words of the topic. Possibly covering: \"who, what, where, when, why and how\"): "),
+        "{INJECT_RESEARCHDESIGN}": input("Please enter the research design (e.g. \"Exploratory\"): "),
+        "{INJECT_DOMAIN}": input("Please enter the domain (e.g. \"Ecological Modelling\"): "),
+        "{INJECT_SPECIALISATION}": input("Please enter the specialisation (e.g. \"Ecological Dynamics\"): "),
+        "{INJECT_DOMAIN_RELATED_ROLE}": input("Please enter the role associated with the domain (e.g. \"Sociologist, Economist, Ecologist\"): "),
+    })
+    return injects
+
+
+def inject_prompt(prompt, injectables):
+    # inject values
+    for tag, value in injectables.items():
+        if value is not None:
+            prompt = prompt.replace(tag, value)
+    return prompt
+
+
+def add_reminder(prompt_name, prompt, prompt_name_out_map):
+    # reminder_<name> prompts repeat an earlier output
+    if prompt_name.startswith("reminder_"):
+        key = prompt_name.split("_")[-1]
+        prompt += prompt_name_out_map.get(key, "")
+    return prompt
+
+
+def build_prompt(prompt_name, prompt, injectables, prompt_name_out_map):
+    return add_reminder(prompt_name, inject_prompt(prompt, injectables), prompt_name_out_map)
+
+
+def record_turn(result, msgs, turn):
+    # adds a finished turn (a dict as stored in ConversationResult.turns) to the history and the maps
+    msgs.append({"role": "user", "content": turn["prompt"]})
+    msgs.append({"role": "assistant", "content": turn["response"]})
+    result.prompt_output_map[turn["prompt"]] = turn["response"]
+    result.prompt_name_out_map[turn["prompt_name"]] = turn["response"]
+    result.total_in += turn["input_tokens"]
+    result.total_out += turn["output_tokens"]
+    result.turns.append(turn)
+
+
+async def run_conversation(provider, script, injectables, params=None, verbose=False, echo=True,
+                           system_prompt=SYSTEM_PROMPT, journal=None, history=None, stream=False, telemetry=None,
+                           run_id=None):
+    # with a journal (eabss_journal.Journal), every turn is written to disk as it completes and the
+    # turns already in the journal are replayed instead of being sent again.
+    # with a history (eabss_history.HistoryManager), each request only carries the turns that fit
+    # its token budget instead of the whole conversation.
+    # with stream=True replies are printed and journaled piece by piece as they arrive, and the
+    # time to the first token is recorded per turn.
+    # with a telemetry exporter (eabss_telemetry.MetricsExporter), every turn's latencies and token
+    # counts are written out under run_id
+    params = params or {}
+    result = ConversationResult()
+    msgs = [{"role": "system", "content": system_prompt}]  # conversation history, sent at every turn
+    next_prompt = None  # injection of the next prompt, prepared while the current reply streams
+
+    for index, (prompt_name, prompt) in enumerate(script):
+        if journal is not None and index < len(journal.turns):
+            turn = journal.turns[index]
+            if turn["prompt_name"] != prompt_name:
+                raise ValueError(f"journal {journal.path} does not match the script: turn {index} is "
+                                 f"{turn['prompt_name']!r}, the script has {prompt_name!r}")
+            record_turn(result, msgs, turn)
+            if history is not None:
+                history.add(prompt_name, turn["prompt"], turn["response"])
+            if echo:
+                print(f"resumed {prompt_name} from {journal.path}")
+            continue
+
+        prompt = await next_prompt if next_prompt is not None else inject_prompt(prompt, injectables)
+        next_prompt = None
+        # the reminder needs the outputs so far, so it is only added once the previous turn is done
+        prompt = add_reminder(prompt_name, prompt, result.prompt_name_out_map)
+        if echo:
+            print(prompt, "\n>>>")
+        if index + 1 < len(script):
+            next_prompt = asyncio.create_task(asyncio.to_thread(inject_prompt, script[index + 1][1], injectables))
+
+        if history is not None:
+            request, context = history.build(system_prompt, prompt)
+        else:
+            request, context = msgs + [{"role": "user", "content": prompt}], None
+        start = time.perf_counter()
+        attempt_start, first_token = start, None
+
+        def on_attempt():
+            nonlocal attempt_start, first_token
+            if first_token is not None:
+                # the stream broke off and is retried from the start: drop the pieces already shown
+                # and journaled, and time the first token of the new attempt
+                if echo:
+                    print("\n[stream interrupted, retrying]\n")
+                if journal is not None:
+                    journal.discard_partial(index)
+            attempt_start, first_token = time.perf_counter(), None
+
+        def on_token(piece):
+            nonlocal first_token
+            if first_token is None:
+                first_token = time.perf_counter()
+            if echo:
+                print(piece, end="", flush=True)
+            if journal is not None:
+                journal.append_partial(index, piece)
+
+        reply = await provider.request(request, params, on_token if stream else None, on_attempt)
+        if first_token is not None:
+            reply.ttft = first_token - attempt_start
+        turn = {
+            "index": index,
+            "prompt_name": prompt_name,
+            "prompt": prompt,
+            "response": reply.content,
+            "input_tokens": reply.input_tokens,
+            "output_tokens": reply.output_tokens,
+            "wall_time": time.perf_counter() - start,
+            "ttft": reply.ttft,
+        }
+        if context is not None:
+            turn["context"] = context  # exactly which earlier turns were sent, and how
+        # bookkeeping
+        record_turn(result, msgs, turn)
+        if history is not None:
+            history.add(prompt_name, prompt, reply.content)
+        if journal is not None:
+            journal.append(turn)
+        if telemetry is not None:
+            telemetry.record(turn, reply.raw, run_id, provider.name, provider.model)
+
+        if echo:
+            print("\n" if stream else reply.content)
+            if verbose:
+                print(f"\n\ninput tokens used this turn: {reply.input_tokens}, "
+                      f"total input tokens used so far: {result.total_in} | "
+                      f"output tokens used this turn: {reply.output_tokens}, "
+                      f"total output tokens used so far: {result.total_out}\n"
+                      f"total tokens used so far: {result.total_in + result.total_out}")
+                if reply.ttft is not None:
+                    print(f"time to first token: {reply.ttft:.2f} s, turn took {turn['wall_time']:.2f} s")
+                if context is not None:
+                    print(f"context sent: ~{context['tokens']} of {context['budget']} tokens, "
+                          f"{len(context['full'])} turns in full, {len(context['summary'])} shortened, "
+                          f"{len(context['dropped'])} dropped ({', '.join(context['dropped']) or 'none'})")
+            print("\n\n\n" + "-"*40 + "\n\n\n")
+
+    return result
+
+
+def write_results(result, path):
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(result.prompt_output_map, fp, ensure_ascii=False, indent=2)
+    return path
+
+
+# command line shared by the single-run bots
+
+def add_common_arguments(parser):
+    # the flags every bot takes; each bot adds its provider's own sampling flags
+    parser.add_argument("--model", type=str, required=True, help="Name of the model to use")
+    parser.add_argument("--prompt-filepath", type=str, required=True, help="File path to JSON file that stores prompts (path should be relative to the directory from where this script is called)")
+    # optional flags
+    parser.add_argument("--temperature", type=float, help="Sampling temperature")
+    parser.add_argument("--verbose", action="store_true", help="Print prompt/completion token counts and running total after each reply")
+    parser.add_argument("--context-budget", type=int, help="Approximate token budget for the history sent with each prompt (default: send the whole conversation)")
+    parser.add_argument("--stream", action="store_true", help="Print replies token by token as they are generated and record time-to-first-token")
+    parser.add_argument("--record", type=str, help="Cassette file (.jsonl) to record every request/response with its latency to, for offline replay")
+    parser.add_argument("--metrics", type=str, help="JSON-lines file to write per-turn latency and token metrics to")
+    parser.add_argument("--prometheus-port", type=int, help="Serve the metrics in Prometheus text format on this port (/metrics)")
+    parser.add_argument("--results-db", type=str, help="SQLite results store (see eabss_results.py) to also add the finished run to")
+    parser.add_argument("--resume", type=str, help="Journal (.journal.jsonl) of an interrupted run; continues from its first prompt without a response")
+    return parser
+
+
+async def run_bot(provider_name, args, params, ask_injectables, file_stem="run"):
+    # one interactive run as the bots do it: args from add_common_arguments, params the sampling
+    # settings (unset (None) ones keep the model defaults). Writes <model>_<file_stem>_<time>.json
+    # and its .journal.jsonl, and returns the ConversationResult.
+    # imported here, as these modules build on this one
+    from eabss_cassette import RecordingProvider
+    from eabss_history import HistoryManager
+    from eabss_journal import journal_run_id, open_journal
+    from eabss_results import ResultsStore, topic_of
+    from eabss_telemetry import MetricsExporter
+
+    provider = make_provider(provider_name, args.model)  # exits early if the provider's API key is missing
+    stem = f"{args.model}_{file_stem}_{time.strftime('%Y%m%d-%H%M%S')}"
+    if args.record:
+        provider = RecordingProvider(provider, args.record)
+    # every finished turn is journaled, so an interrupted run can be continued with --resume
+    journal, injectables, params = open_journal(
+        args.resume, f"{stem}.journal.jsonl", provider_name, args.model, params, args.prompt_filepath, ask_injectables
+    )
+    # keeps each request within the budget, pinning the key artefacts (see eabss_history)
+    run_id = journal_run_id(journal.path)
+    history = HistoryManager(args.context_budget) if args.context_budget else None
+    telemetry = MetricsExporter(args.metrics, args.prometheus_port) if args.metrics or args.prometheus_port else None
+    try:
+        result = await run_conversation(provider, load_script(args.prompt_filepath), injectables, params, args.verbose,
+                                        journal=journal, history=history, stream=args.stream,
+                                        telemetry=telemetry, run_id=run_id)
+    finally:
+        await provider.aclose()
+        if telemetry is not None:
+            telemetry.close()
+
+    results_file = write_results(result, f"{stem}.json")
+    if args.results_db:
+        # index the run for queries across runs, e.g. one prompt's outputs per model and temperature
+        store = ResultsStore(args.results_db)
+        store.add_result(run_id, result, source=results_file,
+                         provider=provider_name, model=args.model, topic=topic_of(injectables), params=params)
+        store.close()
+    return result
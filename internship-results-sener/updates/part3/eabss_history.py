@@ -0,0 +1,114 @@
+"""
+Token-budgeted conversation history for the EABSS conversation loop.
+
+Without it every turn resends the whole conversation, so input tokens grow roughly
+quadratically over the 59 prompts and ollama silently cuts the oldest tokens once num_ctx is
+exceeded. HistoryManager builds the messages of each request within budget tokens:
+
+- the system prompt, the new prompt and the last keep_recent turns are always sent in full
+- turns whose prompt name matches PINNED_PATTERNS (keyAim, keyObjectives, the final Mermaid
+  diagrams, ...) are always sent in full, since later steps build on them
+- *Draft turns are dropped once the final version of the same step has been answered
+- the remaining turns are added newest first, in full while they fit, otherwise shortened to
+  their first summary_chars characters, otherwise dropped
+
+build() also returns a report of what was sent, which run_conversation stores with the turn.
+
+Usage example:
+history = HistoryManager(budget=8000)
+result = await run_conversation(provider, script, injectables, params, history=history)
+"""
+
+import re
+
+PINNED_PATTERNS = (
+    r"keyAim",
+    r"keyObjectives",
+    r"keyHypotheses",
+    r"keyExperimentalFactors",
+    r"keyOutputs",
+    r"keyUmlActors",
+    r"keyMermaid\w*Script",  # final diagrams only, the *ScriptDraft turns do not match
+    r"keyStateVariablesTable",
+    r"keyStateTransitionsTable",
+)
+
+
+def approx_tokens(text):
+    # about 4 characters per token; the real tokeniser differs per provider
+    return len(text) // 4 + 1
+
+
+class HistoryManager:
+    def __init__(self, budget, pinned_patterns=PINNED_PATTERNS, keep_recent=2, summary_chars=600,
+                 token_counter=approx_tokens) -> None:
+        self.budget = budget
+        self.pinned = re.compile("|".join(f"(?:{pattern})" for pattern in pinned_patterns))
+        self.keep_recent = keep_recent
+        self.summary_chars = summary_chars
+        self.token_counter = token_counter
+        self.turns = []  # (prompt_name, prompt, response)
+
+    def add(self, prompt_name, prompt, response):
+        self.turns.append((prompt_name, prompt, response))
+
+    def is_pinned(self, prompt_name):
+        return self.pinned.fullmatch(prompt_name) is not None
+
+    def is_stale_draft(self, index):
+        prompt_name = self.turns[index][0]
+        if not prompt_name.endswith("Draft"):
+            return False
+        final = prompt_name[:-len("Draft")]
+        return any(name == final for name, _, _ in self.turns[index + 1:])
+
+    def shorten(self, prompt_name, text):
+        if len(text) <= self.summary_chars:
+            return text
+        return f"{text[:self.summary_chars]} [... rest of {prompt_name} omitted]"
+
+    def turn_messages(self, index, mode):
+        prompt_name, prompt, response = self.turns[index]
+        if mode == "summary":
+            prompt, response = self.shorten(prompt_name, prompt), self.shorten(prompt_name, response)
+        return [{"role": "user", "content": prompt}, {"role": "assistant", "content": response}]
+
+    def cost(self, messages):
+        return sum(self.token_counter(m["content"]) for m in messages)
+
+    def build(self, system_prompt, prompt):
+        # returns (messages, report); report = {"budget", "tokens", "full", "summary", "dropped"}
+        system = {"role": "system", "content": system_prompt}
+        user = {"role": "user", "content": prompt}
+        used = self.cost([system, user])
+        modes = {}  # turn index -> "full" | "summary"
+
+        n_turns = len(self.turns)
+        required = [i for i in range(n_turns) if i >= n_turns - self.keep_recent or self.is_pinned(self.turns[i][0])]
+        for i in required:
+            modes[i] = "full"
+            used += self.cost(self.turn_messages(i, "full"))
+
+        for i in reversed(range(n_turns)):
+            if i in modes or self.is_stale_draft(i):
+                continue
+            for mode in ("full", "summary"):
+                tokens = self.cost(self.turn_messages(i, mode))
+                if used + tokens <= self.budget:
+                    modes[i] = mode
+                    used += tokens
+                    break
+
+        messages = [system]
+        for i in sorted(modes):
+            messages.extend(self.turn_messages(i, modes[i]))
+        messages.append(user)
+
+        report = {
+            "budget": self.budget,
+            "tokens": used,  # may exceed the budget if the pinned and recent turns alone do
+            "full": [self.turns[i][0] for i in sorted(modes) if modes[i] == "full"],
+            "summary": [self.turns[i][0] for i in sorted(modes) if modes[i] == "summary"],
+            "dropped": [self.turns[i][0] for i in range(n_turns) if i not in modes],
+        }
+        return messages, report
@@ -0,0 +1,139 @@
+"""
+Append-only journal of an EABSS conversation, for checkpoint and resume.
+
+The journal is a JSON-lines file: the first line holds the run settings (provider, model,
+sampling parameters, injectables, prompt script), every following line one finished turn.
+Each line is flushed and fsynced as soon as the turn completes, so a crash loses at most the
+turn that was in flight; when streaming, that turn's text so far is kept in "partial" lines
+(and dropped by a "discard" line when the turn is retried). Opening an existing journal reads it
+back; run_conversation then replays the recorded turns into the conversation history and
+continues from the first prompt that has no response.
+
+Usage example:
+journal = Journal("gemma3_journal.jsonl", header={"model": "gemma3:12b-it-qat", ...})
+result = await run_conversation(provider, script, injectables, params, journal=journal)
+"""
+
+import json
+import os
+import time
+
+PARTIAL_FLUSH_SEC = 0.5  # streamed pieces are written at most this often
+
+
+class Journal:
+    def __init__(self, path, header=None) -> None:
+        self.path = path
+        if os.path.exists(path):
+            self.header, self.turns, self.partial = self.read(path)
+            self.repair_tail()
+        else:
+            self.header, self.turns, self.partial = header or {}, [], {}
+            self.write_line({"type": "header", **self.header})
+        self.pending = []  # streamed pieces not yet written
+        self.pending_index = None
+        self.flushed = time.monotonic()
+
+    @staticmethod
+    def read(path):
+        # partial: {turn index: text streamed so far} of turns that never finished; not replayed
+        header, turns, partial = {}, [], {}
+        with open(path, encoding="utf-8") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line was cut off by a crash mid-write; that turn is simply redone
+                    break
+                kind = record.pop("type")
+                if kind == "header":
+                    header = record
+                elif kind == "turn":
+                    turns.append(record)
+                    partial.pop(record["index"], None)
+                elif kind == "partial":
+                    partial[record["index"]] = partial.get(record["index"], "") + record["text"]
+                elif kind == "discard":
+                    partial.pop(record["index"], None)
+        return header, turns, partial
+
+    def repair_tail(self):
+        # a crash mid-write leaves a cut-off last line, which read() ignores; it is truncated away
+        # (or, if only its newline is missing, completed) so new lines do not get appended onto it
+        with open(self.path, "rb+") as fp:
+            end = 0
+            for line in fp:
+                try:
+                    json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                end += len(line)
+                if not line.endswith(b"\n"):
+                    fp.write(b"\n")
+                    return
+            fp.truncate(end)
+
+    def write_line(self, record):
+        with open(self.path, "a", encoding="utf-8") as fp:
+            fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def append(self, turn):
+        # the finished turn supersedes its streamed pieces, so those still buffered are not written
+        self.pending = []
+        self.pending_index = None
+        self.turns.append(turn)
+        self.write_line({"type": "turn", **turn})
+
+    def append_partial(self, index, text):
+        # streamed pieces are buffered and written in batches, without fsync, so a crash or a
+        # cancelled turn still leaves what was generated so far on disk
+        if self.pending_index not in (None, index):
+            self.flush_partial()
+        self.pending_index = index
+        self.pending.append(text)
+        if time.monotonic() - self.flushed >= PARTIAL_FLUSH_SEC:
+            self.flush_partial()
+
+    def discard_partial(self, index):
+        # the streamed turn is retried from the start; what its failed attempt left is dropped
+        self.pending = []
+        self.pending_index = None
+        self.partial.pop(index, None)
+        self.write_line({"type": "discard", "index": index})
+
+    def flush_partial(self):
+        if self.pending:
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(json.dumps({"type": "partial", "index": self.pending_index, "text": "".join(self.pending)},
+                                    ensure_ascii=False) + "\n")
+        self.pending = []
+        self.pending_index = None
+        self.flushed = time.monotonic()
+
+
+def journal_run_id(path):
+    # the run's name: the journal file name without its .journal.jsonl suffix, which also names
+    # the run's result JSON, its metrics and its row in the results store
+    name = os.path.basename(path)
+    return name[:-len(".journal.jsonl")] if name.endswith(".journal.jsonl") else os.path.splitext(name)[0]
+
+
+def open_journal(resume_path, new_path, provider, model, params, script_path, ask_injectables):
+    # returns (journal, injectables, params); a resumed run takes its injectables and sampling
+    # parameters from the journal, so the user is not asked again and the run stays consistent.
+    # provider and model must be the journal's, else one run would mix the replies of two models
+    if resume_path:
+        if not os.path.exists(resume_path):
+            raise SystemExit(f"no such journal: {resume_path}")
+        journal = Journal(resume_path)
+        recorded = (journal.header.get("provider"), journal.header.get("model"))
+        if recorded != (provider, model):
+            raise SystemExit(f"{resume_path} was run with {recorded[0]} model {recorded[1]!r}, not {provider} model "
+                             f"{model!r}; resume it with --model {recorded[1]}")
+        print(f"resuming {resume_path}: {len(journal.turns)} turns already answered")
+        return journal, journal.header["injectables"], journal.header["params"]
+    injectables = ask_injectables()
+    header = {"provider": provider, "model": model, "params": params, "script": script_path, "injectables": injectables}
+    return Journal(new_path, header), injectables, params
@@ -0,0 +1,173 @@
+"""
+Request and token rate limiting with retries for the EABSS provider adapters.
+
+Every (provider, model) pair gets one RateLimiter per process, shared by all conversations that
+use it: a token bucket for requests per minute, a token bucket for tokens per minute, and a
+retry loop for 429s, 5xx responses and connection errors that honours Retry-After and otherwise
+backs off exponentially with full jitter. A 429 pauses the whole limiter, so concurrent
+conversations wait too instead of all hitting the limit again.
+
+Limits are set per provider, with optional per-model overrides; missing values mean unlimited.
+burst (requests) and token_burst (tokens) are the bucket sizes, i.e. how much may go out at once
+after an idle period; they default to a full minute's worth, so up to twice the per-minute limit
+can go out in the first minute. Quotas that are enforced per rolling minute need a burst of 1.
+They can be given to configure_limits or in a JSON file named by the EABSS_RATE_LIMITS variable:
+{
+  "openai": {"rpm": 500, "tpm": 200000, "models": {"o4-mini-2025-04-16": {"rpm": 1000, "tpm": 2000000}}},
+  "gemini": {"rpm": 5, "burst": 1}
+}
+"""
+
+import asyncio
+import email.utils
+import json
+import os
+import random
+import time
+
+import httpx
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # capacity tokens, refilled continuously at rate_per_minute; rate_per_minute None means unlimited
+    def __init__(self, rate_per_minute=None, capacity=None) -> None:
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = capacity or rate_per_minute or 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        if self.rate is None:
+            return
+        # a request larger than the bucket waits for a full bucket rather than forever
+        amount = min(amount, self.capacity)
+        async with self.lock:  # first come, first served
+            while True:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, amount):
+        # settle the difference between the estimated and the actual token count; may go negative
+        if self.rate is None:
+            return
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def retry_after_seconds(response):
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(0.0, date.timestamp() - time.time()) if date else None
+
+
+class RateLimiter:
+    def __init__(self, rpm=None, tpm=None, burst=None, token_burst=None, max_retries=6, base_delay=1.0,
+                 max_delay=60.0) -> None:
+        self.requests = TokenBucket(rpm, burst)
+        self.token_bucket = TokenBucket(tpm, token_burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+
+    async def wait_if_paused(self):
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt, response=None):
+        delay = retry_after_seconds(response)
+        if delay is None:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if response is not None and response.status_code == 429:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+    async def call(self, request, estimated_tokens=0):
+        # request is a coroutine function returning a TurnResult
+        for attempt in range(self.max_retries + 1):
+            await self.wait_if_paused()
+            await self.requests.acquire(1)
+            await self.token_bucket.acquire(estimated_tokens)
+            try:
+                turn = await request()
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e.response)
+                print(f"HTTP {e.response.status_code}, retrying in {delay:.1f} s")
+            except httpx.UnsupportedProtocol:
+                raise  # a malformed base url, retrying cannot help
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                print(f"{type(e).__name__}, retrying in {delay:.1f} s")
+            else:
+                self.token_bucket.adjust(turn.input_tokens + turn.output_tokens - estimated_tokens)
+                return turn
+            await asyncio.sleep(delay)
+
+
+LIMITS = {}
+LIMITERS = {}
+
+
+def configure_limits(limits):
+    # limits: dict as in the module docstring, or the path of a JSON file holding it
+    if isinstance(limits, str):
+        with open(limits, encoding="utf-8") as fp:
+            limits = json.load(fp)
+    merge_limits(LIMITS, limits)
+    LIMITERS.clear()
+
+
+def merge_limits(target, limits):
+    # deep merge, so configuring one model keeps the provider's other settings and models
+    for key, value in limits.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_limits(target[key], value)
+        else:
+            target[key] = value
+
+
+def configure_default_limits(provider, model, settings):
+    # settings for provider and model unless limits were already configured for either of them
+    # (e.g. through EABSS_RATE_LIMITS), so a bot's built-in default never overrides the user's
+    configured = dict(LIMITS.get(provider, {}))
+    if configured.pop("models", {}).get(model) or configured:
+        return
+    configure_limits({provider: {"models": {model: settings}}})
+
+
+def get_limiter(provider, model):
+    key = (provider, model)
+    if key not in LIMITERS:
+        settings = dict(LIMITS.get(provider, {}))
+        settings.update(settings.pop("models", {}).get(model, {}))
+        LIMITERS[key] = RateLimiter(**settings)
+    return LIMITERS[key]
+
+
+def estimate_tokens(messages):
+    # about 4 characters per token; only used until the provider reports the real count
+    return sum(len(m["content"]) for m in messages) // 4
+
+
+if os.getenv("EABSS_RATE_LIMITS"):
+    configure_limits(os.getenv("EABSS_RATE_LIMITS"))
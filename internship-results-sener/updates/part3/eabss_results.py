@@ -0,0 +1,300 @@
+"""
+Indexed results store for EABSS runs.
+
+Every run is one row in runs (model, provider, topic, temperature, top_k, top_p, repeat_penalty,
+the full parameter JSON) and every turn one row in turns (prompt_name, prompt, response, tokens,
+wall time, time to first token), in one SQLite file with indexes on prompt name, model and the
+sampling parameters, so comparisons across hundreds of runs are single queries instead of
+loading and string-matching every result JSON.
+
+Runs get in three ways: the bots and eabss_batch.py add them when given a results database,
+journals (*.journal.jsonl) are imported with their settings, and the existing prompt-keyed
+dumps (test_dump, final_*, before_final) are imported by matching each prompt against the
+prompt scripts to recover its prompt name, and parsing model and sampling parameters from the
+file name (e.g. gemma3_12b_itqat_0.6temp_40topk_0.8topp_latest_test_20250719-201241.json).
+
+Usage example:
+python eabss_results.py import test_dump final_o4_mini final_tuned_gemma3 before_final --db results.sqlite
+python eabss_results.py query --db results.sqlite --prompt-name gamlStep5 --model gemma3 --temperature 0.6
+python eabss_results.py export --db results.sqlite turns.parquet
+"""
+
+import argparse
+import csv
+import difflib
+import glob
+import json
+import os
+import re
+import sqlite3
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SCRIPTS = [
+    os.path.join(SCRIPT_DIR, "streamlining_eabss_3_advanced_model_script.json"),
+    os.path.join(SCRIPT_DIR, "streamlining_eabss_3_small_medium_model_script.json"),
+]
+DEFAULT_TOPICS_DIR = os.path.join(SCRIPT_DIR, "test_prompts")
+SIMILARITY_CHARS = 300  # prompt prefix compared when no template matches exactly
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    source TEXT,
+    provider TEXT,
+    model TEXT,
+    topic TEXT,
+    temperature REAL,
+    top_k INTEGER,
+    top_p REAL,
+    repeat_penalty REAL,
+    params TEXT,
+    started TEXT
+);
+CREATE TABLE IF NOT EXISTS turns (
+    run_id TEXT REFERENCES runs(run_id) ON DELETE CASCADE,
+    idx INTEGER,
+    prompt_name TEXT,
+    prompt TEXT,
+    response TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    wall_time REAL,
+    ttft REAL,
+    PRIMARY KEY (run_id, idx)
+);
+CREATE INDEX IF NOT EXISTS turns_prompt_name ON turns (prompt_name);
+CREATE INDEX IF NOT EXISTS runs_model ON runs (model, temperature, top_k, top_p);
+CREATE INDEX IF NOT EXISTS runs_topic ON runs (topic);
+"""
+
+RUN_COLUMNS = ("run_id", "source", "provider", "model", "topic", "temperature", "top_k", "top_p", "repeat_penalty",
+               "params", "started")
+TURN_COLUMNS = ("run_id", "idx", "prompt_name", "prompt", "response", "input_tokens", "output_tokens", "wall_time", "ttft")
+
+
+class PromptMatcher:
+    # recovers prompt names from injected prompts: each script prompt becomes a regex in which
+    # the {INJECT_*} placeholders match anything; prompts from older script versions, worded
+    # slightly differently, fall back to the most similar template
+    def __init__(self, script_paths=DEFAULT_SCRIPTS, topics_dir=DEFAULT_TOPICS_DIR, min_similarity=0.8) -> None:
+        self.min_similarity = min_similarity
+        self.patterns = []
+        self.templates = []
+        self.cache = {}  # the same injected prompts recur in every run of a topic
+        for path in script_paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as fp:
+                for line in json.load(fp):
+                    for prompt_name, prompt in line.items():
+                        parts = re.split(r"\{INJECT_[A-Z_]+\}", prompt)
+                        pattern = ".*?".join(re.escape(part) for part in parts)
+                        self.patterns.append((prompt_name, re.compile(pattern, re.DOTALL)))
+                        self.templates.append((prompt_name, prompt[:SIMILARITY_CHARS]))
+        self.topics = {}
+        for path in sorted(glob.glob(os.path.join(topics_dir, "*.txt"))):
+            with open(path, encoding="utf-8") as fp:
+                # the start of the topic text, without its "Key Topic:" label, recognises it in the prompts
+                text = re.sub(r"^Key Topic:\s*", "", fp.read().strip())
+                self.topics[os.path.splitext(os.path.basename(path))[0]] = text[:200]
+
+    def prompt_name(self, prompt):
+        if prompt not in self.cache:
+            self.cache[prompt] = self.match(prompt)
+        return self.cache[prompt]
+
+    def match(self, prompt):
+        for prompt_name, pattern in self.patterns:
+            if pattern.fullmatch(prompt):
+                return prompt_name
+        best, best_ratio = None, self.min_similarity
+        matcher = difflib.SequenceMatcher(b=prompt[:SIMILARITY_CHARS], autojunk=False)
+        for prompt_name, template in self.templates:
+            matcher.set_seq1(template)
+            if matcher.quick_ratio() >= best_ratio and (ratio := matcher.ratio()) >= best_ratio:
+                best, best_ratio = prompt_name, ratio
+        return best
+
+    def topic(self, prompts):
+        for topic, text in self.topics.items():
+            if text and any(text in prompt for prompt in prompts):
+                return topic
+        return None
+
+
+def topic_of(injectables, topics_dir=DEFAULT_TOPICS_DIR):
+    # name of the test_prompts topic injected as {INJECT_TOPIC}, if it is one of them
+    return PromptMatcher(script_paths=[], topics_dir=topics_dir).topic([injectables.get("{INJECT_TOPIC}") or ""])
+
+
+def parse_dump_name(path):
+    # <model>[_<temp>temp][_<k>topk][_<p>topp][_latest]_(test|run)_<YYYYmmdd-HHMMSS>[_<topic>].json
+    name = os.path.splitext(os.path.basename(path))[0]
+    match = re.match(r"(?P<model>.+?)_(?:test|run)_(?P<started>\d{8}-\d{6})(?:_(?P<topic>.+))?$", name)
+    if match is None:
+        return {"model": name, "started": None, "topic": None, "params": {}}
+    model = match["model"]
+    params = {}
+    for key, pattern, cast in (("temperature", r"(\d*\.?\d+)temp", float), ("top_k", r"(\d+)topk", int),
+                               ("top_p", r"(\d*\.?\d+)topp", float)):
+        if found := re.search(pattern, model):
+            params[key] = cast(found.group(1))
+    return {"model": model, "started": match["started"], "topic": match["topic"], "params": params}
+
+
+class ResultsStore:
+    def __init__(self, path="results.sqlite") -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def add_run(self, run_id, turns, source=None, provider=None, model=None, topic=None, params=None, started=None):
+        # turns: dicts with prompt_name, prompt, response and optionally the token and timing fields
+        # of ConversationResult.turns; re-adding a run_id replaces it. unset (None) params are left out
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        with self.conn:
+            self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.conn.execute(
+                f"INSERT INTO runs VALUES ({', '.join('?' * len(RUN_COLUMNS))})",
+                (run_id, source, provider, model, topic, params.get("temperature"), params.get("top_k"),
+                 params.get("top_p"), params.get("repeat_penalty"), json.dumps(params, sort_keys=True), started),
+            )
+            self.conn.executemany(
+                f"INSERT INTO turns VALUES ({', '.join('?' * len(TURN_COLUMNS))})",
+                [(run_id, turn.get("index", idx), turn.get("prompt_name"), turn["prompt"], turn["response"],
+                  turn.get("input_tokens"), turn.get("output_tokens"), turn.get("wall_time"), turn.get("ttft"))
+                 for idx, turn in enumerate(turns)],
+            )
+
+    def add_result(self, run_id, result, **run):
+        # a ConversationResult straight from run_conversation
+        self.add_run(run_id, result.turns, **run)
+
+    def import_dump(self, path, matcher):
+        with open(path, encoding="utf-8") as fp:
+            dump = json.load(fp)
+        info = parse_dump_name(path)
+        turns = [{"prompt_name": matcher.prompt_name(prompt), "prompt": prompt, "response": response}
+                 for prompt, response in dump.items()]
+        # the topic text in the prompts wins over a topic suffix in the file name
+        topic = matcher.topic(dump.keys()) or info["topic"]
+        self.add_run(os.path.splitext(os.path.basename(path))[0], turns, source=path, model=info["model"],
+                     topic=topic, params=info["params"], started=info["started"])
+        return len(turns)
+
+    def import_journal(self, path, matcher):
+        from eabss_journal import Journal, journal_run_id
+        header, turns, _ = Journal.read(path)
+        topic = header.get("topic") or matcher.topic([(header.get("injectables") or {}).get("{INJECT_TOPIC}") or ""])
+        self.add_run(journal_run_id(path), turns, source=path, provider=header.get("provider"),
+                     model=header.get("model"), topic=topic, params=header.get("params"))
+        return len(turns)
+
+    def import_paths(self, paths, matcher=None):
+        # files or directories; *.journal.jsonl are journals, other *.json files prompt-keyed dumps
+        # (skipped when the run's journal sits next to them)
+        matcher = matcher or PromptMatcher()
+        imported = 0
+        for path in paths:
+            files = sorted(glob.glob(os.path.join(path, "*.json*"))) if os.path.isdir(path) else [path]
+            for file in files:
+                if file.endswith(".journal.jsonl"):
+                    self.import_journal(file, matcher)
+                elif file.endswith(".json") and os.path.basename(file) != "summary.json":
+                    if os.path.exists(file[:-len(".json")] + ".journal.jsonl"):
+                        continue  # the run's journal has the same turns plus settings, tokens and timings
+                    try:
+                        self.import_dump(file, matcher)
+                    except (json.JSONDecodeError, AttributeError):
+                        print(f"Skipping {file}: not a prompt -> response result file")
+                        continue
+                else:
+                    continue
+                imported += 1
+        return imported
+
+    def query(self, prompt_name=None, model=None, topic=None, temperature=None, top_k=None, top_p=None, run_id=None):
+        # model matches as a substring, e.g. "gemma3"; returns a list of dicts, one per turn
+        conditions, values = [], []
+        for column, value in (("t.prompt_name", prompt_name), ("r.topic", topic), ("r.top_k", top_k), ("r.run_id", run_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                values.append(value)
+        for column, value in (("r.temperature", temperature), ("r.top_p", top_p)):
+            if value is not None:
+                conditions.append(f"ABS({column} - ?) < 1e-9")
+                values.append(value)
+        if model is not None:
+            conditions.append("r.model LIKE ?")
+            values.append(f"%{model}%")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.conn.execute(
+            f"SELECT r.run_id, r.model, r.provider, r.topic, r.temperature, r.top_k, r.top_p, r.started, "
+            f"t.idx, t.prompt_name, t.prompt, t.response, t.input_tokens, t.output_tokens, t.wall_time, t.ttft "
+            f"FROM turns t JOIN runs r ON r.run_id = t.run_id {where} ORDER BY r.run_id, t.idx",
+            values,
+        )
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def export(self, path, **filters):
+        # .parquet (columnar, needs pyarrow) or .csv, one row per turn with its run's settings
+        rows = self.query(**filters)
+        if path.endswith(".parquet"):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise SystemExit("Exporting .parquet needs the pyarrow package (pip install pyarrow); use .csv otherwise")
+            columns = list(rows[0].keys()) if rows else []
+            pq.write_table(pa.table({column: [row[column] for row in rows] for column in columns}), path)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as fp:
+                writer = csv.DictWriter(fp, fieldnames=list(rows[0].keys()) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
+        return len(rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed store of EABSS run results")
+    # --db goes after the subcommand, as in the usage examples
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", type=str, default="results.sqlite", help="SQLite file of the store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    importer = subparsers.add_parser("import", parents=[common], help="Import result dumps and journals (files or folders)")
+    importer.add_argument("paths", nargs="+")
+    for name in ("query", "export"):
+        sub = subparsers.add_parser(name, parents=[common])
+        if name == "export":
+            sub.add_argument("out", type=str, help="Output file, .parquet or .csv")
+        sub.add_argument("--prompt-name", type=str)
+        sub.add_argument("--model", type=str, help="Substring of the model name")
+        sub.add_argument("--topic", type=str)
+        sub.add_argument("--temperature", type=float)
+        sub.add_argument("--top-k", type=int)
+        sub.add_argument("--top-p", type=float)
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.command == "import":
+        print(f"imported {store.import_paths(args.paths)} runs into {args.db}")
+    else:
+        filters = {"prompt_name": args.prompt_name, "model": args.model, "topic": args.topic,
+                   "temperature": args.temperature, "top_k": args.top_k, "top_p": args.top_p}
+        if args.command == "query":
+            for row in store.query(**filters):
+                print(f"--- {row['run_id']} | {row['prompt_name']} | topic={row['topic']} "
+                      f"temperature={row['temperature']} top_k={row['top_k']} top_p={row['top_p']}")
+                print(row["response"])
+        else:
+            print(f"exported {store.export(args.out, **filters)} turns to {args.out}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Local stub LLM server that replays cassettes over the Ollama and OpenAI chat APIs.
+
+Serves POST /api/chat (Ollama, JSON lines when streaming) and POST /v1/chat/completions
+(OpenAI, server-sent events when streaming) from a cassette written by eabss_cassette.py, with
+recorded or configured latency and token rate, and can answer a fraction of requests with a
+429 and a Retry-After header. Pointing the bots or the batch runner at it measures the engine's
+own overhead, concurrency and retry behaviour without network access or a GPU:
+
+python eabss_stub_server.py cassettes/nemo.jsonl --port 11500 --ttft 0.2 --tokens-per-sec 40 --error-rate 0.05
+OLLAMA_HOST=http://localhost:11500 python eabss_automation_bot.py --model mistral-nemo --prompt-filepath ...
+OPENAI_BASE_URL=http://localhost:11500/v1 OPENAI_API_KEY=stub python chatgpt_eabss_automation_bot.py --model o4-mini ...
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from eabss_cassette import Cassette, approx_tokens, replay_timing
+
+
+class StubState:
+    def __init__(self, cassette, latency_scale=1.0, ttft=None, tokens_per_sec=None, error_rate=0.0,
+                 retry_after=1.0, seed=0) -> None:
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)  # seeded, so the injected 429s are reproducible
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            fail = self.random.random() < self.error_rate
+            self.errors += fail
+            return fail
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients reuse their connections
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path not in ("/api/chat", "/v1/chat/completions"):
+            self.send_json(404, {"error": f"unknown endpoint {self.path}"})
+            return
+        if self.state.should_fail():
+            self.send_json(429, {"error": "rate limited by stub"}, {"Retry-After": str(self.state.retry_after)})
+            return
+
+        entry = self.state.cassette.lookup(request.get("messages", []))
+        first, per_token = replay_timing(entry, self.state.latency_scale, self.state.ttft, self.state.tokens_per_sec)
+        output_tokens = entry.get("output_tokens") or approx_tokens(entry["response"])
+        input_tokens = entry.get("input_tokens") or sum(approx_tokens(m["content"]) for m in request.get("messages", []))
+        words = entry["response"].split(" ")
+        pieces = [word if i == len(words) - 1 else word + " " for i, word in enumerate(words)]
+        delay = per_token * output_tokens / len(pieces)
+        ollama = self.path == "/api/chat"
+        # ollama streams unless told otherwise, openai only when asked
+        stream = request.get("stream", ollama)
+
+        time.sleep(first)
+        if not stream:
+            time.sleep(delay * len(pieces))
+            if ollama:
+                self.send_json(200, {
+                    "model": request.get("model"), "message": {"role": "assistant", "content": entry["response"]},
+                    "done": True, "prompt_eval_count": input_tokens, "eval_count": output_tokens,
+                })
+            else:
+                self.send_json(200, {
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": entry["response"]},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                              "total_tokens": input_tokens + output_tokens},
+                })
+            return
+
+        if ollama:
+            self.start_chunked("application/x-ndjson")
+            for piece in pieces:
+                self.write_chunk(json.dumps({"message": {"role": "assistant", "content": piece}, "done": False}) + "\n")
+                time.sleep(delay)
+            self.write_chunk(json.dumps({"done": True, "prompt_eval_count": input_tokens, "eval_count": output_tokens}) + "\n")
+        else:
+            self.start_chunked("text/event-stream")
+            for piece in pieces:
+                self.write_chunk("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]}) + "\n\n")
+                time.sleep(delay)
+            usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                     "total_tokens": input_tokens + output_tokens}
+            self.write_chunk("data: " + json.dumps({"choices": [], "usage": usage}) + "\n\n")
+            self.write_chunk("data: [DONE]\n\n")
+        self.end_chunked()
+
+
+def make_server(cassette_path, host="127.0.0.1", port=11500, **options):
+    handler = type("Handler", (StubHandler,), {"state": StubState(Cassette(cassette_path), **options)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay an EABSS cassette over the Ollama and OpenAI chat APIs")
+    parser.add_argument("cassette", type=str, help="Cassette file (.jsonl) to replay")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Factor applied to recorded latencies")
+    parser.add_argument("--ttft", type=float, help="Seconds before the first token (default: as recorded, else 0)")
+    parser.add_argument("--tokens-per-sec", type=float, help="Output token rate (default: as recorded, else instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the injected errors")
+    args = parser.parse_args()
+
+    server = make_server(args.cassette, args.host, args.port, latency_scale=args.latency_scale, ttft=args.ttft,
+                         tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate,
+                         retry_after=args.retry_after, seed=args.seed)
+    print(f"replaying {args.cassette} on http://{args.host}:{args.port} (ollama: /api/chat, openai: /v1/chat/completions)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state = server.RequestHandlerClass.state
+        print(f"served {state.requests} requests, {state.errors} injected 429s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Per-turn latency and token telemetry for EABSS runs.
+
+MetricsExporter.record() is called by run_conversation after every turn. It appends one JSON
+line per turn to a metrics file: wall time, time to first token, the server-side durations
+Ollama reports (load, prompt eval, eval, total), tokens per second, and input/output tokens,
+labelled with run, provider, model and prompt name. Optionally the same numbers are summed per
+provider, model and prompt name and served in the Prometheus text format on /metrics.
+
+Usage example:
+telemetry = MetricsExporter("gemma3_metrics.jsonl", prometheus_port=9464)
+result = await run_conversation(provider, script, injectables, params, telemetry=telemetry, run_id="gemma3-conway")
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ollama reports durations in nanoseconds
+OLLAMA_DURATIONS = {
+    "load_duration": "load_time",
+    "prompt_eval_duration": "prompt_eval_time",
+    "eval_duration": "eval_time",
+    "total_duration": "server_total_time",
+}
+
+COUNTERS = ("turns", "input_tokens", "output_tokens", "wall_time", "ttft", "ttft_turns", "eval_time", "prompt_eval_time")
+
+
+def turn_metrics(turn, raw):
+    # turn: dict as stored in ConversationResult.turns; raw: the provider's response body
+    metrics = {
+        "index": turn["index"],
+        "prompt_name": turn["prompt_name"],
+        "wall_time": turn["wall_time"],
+        "ttft": turn.get("ttft"),
+        "input_tokens": turn["input_tokens"],
+        "output_tokens": turn["output_tokens"],
+    }
+    for key, name in OLLAMA_DURATIONS.items():
+        if raw.get(key) is not None:
+            metrics[name] = raw[key] / 1e9
+
+    # decode speed: from the server's eval time when known, else from the client's view of the stream
+    if metrics.get("eval_time"):
+        generation_time = metrics["eval_time"]
+    elif metrics["ttft"] is not None:
+        generation_time = metrics["wall_time"] - metrics["ttft"]
+    else:
+        generation_time = metrics["wall_time"]
+    metrics["tokens_per_sec"] = metrics["output_tokens"] / generation_time if generation_time > 0 else None
+    if metrics.get("prompt_eval_time"):
+        metrics["prompt_tokens_per_sec"] = metrics["input_tokens"] / metrics["prompt_eval_time"]
+    return metrics
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class MetricsExporter:
+    def __init__(self, path=None, prometheus_port=None, prometheus_host="0.0.0.0") -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # (provider, model, prompt_name) -> {counter: sum}
+        self.totals = defaultdict(lambda: dict.fromkeys(COUNTERS, 0.0))
+        self.server = None
+        if prometheus_port is not None:
+            self.start_server(prometheus_host, prometheus_port)
+
+    def record(self, turn, raw, run_id=None, provider=None, model=None):
+        metrics = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "run": run_id, "provider": provider, "model": model}
+        metrics.update(turn_metrics(turn, raw))
+        with self.lock:
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as fp:
+                    fp.write(json.dumps(metrics) + "\n")
+            totals = self.totals[(provider, model, metrics["prompt_name"])]
+            totals["turns"] += 1
+            totals["input_tokens"] += metrics["input_tokens"]
+            totals["output_tokens"] += metrics["output_tokens"]
+            totals["wall_time"] += metrics["wall_time"]
+            totals["eval_time"] += metrics.get("eval_time", 0.0)
+            totals["prompt_eval_time"] += metrics.get("prompt_eval_time", 0.0)
+            if metrics["ttft"] is not None:
+                totals["ttft"] += metrics["ttft"]
+                totals["ttft_turns"] += 1
+        return metrics
+
+    def prometheus_text(self):
+        series = [
+            ("eabss_turns_total", "counter", "Finished turns", "turns"),
+            ("eabss_input_tokens_total", "counter", "Prompt tokens sent", "input_tokens"),
+            ("eabss_output_tokens_total", "counter", "Completion tokens received", "output_tokens"),
+            ("eabss_turn_seconds_total", "counter", "Wall time of turns", "wall_time"),
+            ("eabss_ttft_seconds_total", "counter", "Time to first token of streamed turns", "ttft"),
+            ("eabss_streamed_turns_total", "counter", "Streamed turns", "ttft_turns"),
+            ("eabss_eval_seconds_total", "counter", "Server-side generation time (ollama)", "eval_time"),
+            ("eabss_prompt_eval_seconds_total", "counter", "Server-side prompt processing time (ollama)", "prompt_eval_time"),
+        ]
+        with self.lock:
+            items = sorted(self.totals.items(), key=lambda item: tuple(str(part) for part in item[0]))
+            lines = []
+            for name, kind, help_text, key in series:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (provider, model, prompt_name), totals in items:
+                    labels = (f'provider="{escape_label(provider)}",model="{escape_label(model)}",'
+                              f'prompt_name="{escape_label(prompt_name)}"')
+                    lines.append(f"{name}{{{labels}}} {totals[key]}")
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, host, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                data = exporter.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()